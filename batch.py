@@ -0,0 +1,426 @@
+# batch.py: Solves many Bimaru tests in a single process, instead of starting
+# a new interpreter per test as in `python3 bimaru.py < test.txt`.
+#
+# Usage: python3 batch.py [-o OUT] [-j JOBS] [--timings FILE] [--fleet N...]
+#                         [--engine ENGINE] PATH...
+#
+# Each PATH can be a directory (every .txt in it), a glob pattern, a test file
+# or "-" for stdin. A file may hold several tests one after the other. One
+# .out is written per test in OUT (./out by default), followed by a summary of
+# the time spent on each test. A test that can't be parsed is reported as a
+# parse error and counted as unsolved, and the next file is read.
+#
+# Tests are read as they are solved, so a corpus never needs to fit in memory.
+# With more than one job they are solved by a pool of worker processes, one
+# per core by default, and reported as they finish. The files named after the
+# hardest difficulties are solved first; with --timings, the tests are all
+# read first and solved longest expected first.
+#
+# The tests are solved with depth first search by default; --engine picks
+# another search of bimaru.py, or sat to compile each test into clauses for
+# the SAT solver of sat.py.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+import sat
+from bimaru import SEARCHES, Board
+from search import SearchLimits, SearchMetrics
+from validator import validate
+
+
+def expand_paths(paths: List[str]) -> List[str]:
+    """Returns the test files named by the given directories, glob patterns
+    and files, in the order given and sorted within each directory or
+    pattern. "-" is kept as is and stands for stdin."""
+
+    files = []
+
+    for path in paths:
+        if path == "-" or os.path.isfile(path):
+            files.append(path)
+        elif os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.txt"))))
+        else:
+            matches = sorted(glob.glob(path))
+            if not matches:
+                raise FileNotFoundError(f"no tests found for {path}")
+            files.extend(matches)
+
+    return files
+
+
+# The board of a test, or the error raised while parsing it
+Test = Union[Board, ValueError, IndexError]
+
+
+def read_instances(
+    stream: TextIO, name: str, fleet: Optional[List[int]] = None
+) -> Iterator[Tuple[str, Test]]:
+    """Yields every test in the stream as it is read. A stream with a single
+    test is named after it, otherwise its tests are numbered from 1. Tests
+    without a FLEET line of their own have the given fleet.
+
+    A test that can't be parsed is yielded as the error it raised instead
+    of its board, and ends the stream, as the next test can't be found."""
+
+    boards = Board.parse_instances(stream, fleet)
+    first = None  # named once it is known whether a second test follows
+    count = 0
+    try:
+        for count, board in enumerate(boards, 1):
+            if count == 1:
+                first = board
+                continue
+            if count == 2:
+                yield f"{name}-1", first
+            yield f"{name}-{count}", board
+    except (ValueError, IndexError) as error:
+        if count == 0:
+            yield name, error
+            return
+        if count == 1:
+            yield f"{name}-1", first
+        yield f"{name}-{count + 1}", error
+        return
+
+    if count == 1:
+        yield name, first
+
+
+def instances(
+    files: List[str], fleet: Optional[List[int]] = None
+) -> Iterator[Tuple[str, Test]]:
+    """Yields the name and the board of every test in the given files, or
+    the error raised by a test that can't be parsed."""
+
+    for path in files:
+        if path == "-":
+            yield from read_instances(sys.stdin, "stdin", fleet)
+        else:
+            name = os.path.splitext(os.path.basename(path))[0]
+            with open(path) as stream:
+                yield from read_instances(stream, name, fleet)
+
+
+# Tests named after a harder difficulty are expected to take longer.
+DIFFICULTIES = ("impossible", "hard", "medium", "easy")
+
+# The searches of bimaru.py and the SAT solver of sat.py, all of them taking
+# a cleaned up board and the limits of the search.
+ENGINES = dict(SEARCHES, sat=sat.solve_board)
+
+
+Result = Tuple[str, str, str, float, Optional[dict]]
+
+
+def solve_instance(
+    name: str,
+    board: Test,
+    timeout: Optional[float] = None,
+    metrics: bool = False,
+    engine: str = "dfs",
+    trace_memory: bool = False,
+) -> Result:
+    """Solves one test with one of the ENGINES, giving up after timeout
+    seconds if given, returning its name, its output (empty if it has no
+    solution), its status, the seconds it took and, if asked for, the
+    metrics of the search, with the peak memory it allocated if
+    trace_memory. Every solution is validated, and reported as invalid if
+    it breaks a rule. A test that times out also reports how many of its
+    boats were on the board the engine had reached. A test that could not
+    be parsed, given as its error, is reported as such, without metrics."""
+
+    if not isinstance(board, Board):
+        return name, "", f"parse error: {board!r}", 0.0, None
+
+    start_time = time.perf_counter()
+    if metrics:
+        limits = SearchMetrics(max_time=timeout, trace_memory=trace_memory)
+    elif timeout:
+        limits = SearchLimits(max_time=timeout)
+    else:
+        limits = None
+    puzzle = board.copy()
+    try:
+        board.cleanup()
+        result = ENGINES[engine](board, limits=limits)
+    except Exception as error:  # keep going with the remaining tests
+        result = None
+        status = f"error: {error!r}"
+    else:
+        errors = validate(result, puzzle) if result else []
+        if errors:
+            status = "invalid: " + "; ".join(errors)
+            result = None
+        elif result:
+            status = "solved"
+        elif limits and limits.reason:
+            status = f"timed out after {limits.nodes} nodes"
+            if isinstance(limits.node, Board):  # the board it had reached
+                placed = sum(puzzle.fleet) - sum(limits.node.boats)
+                status += f" with {placed} of {sum(puzzle.fleet)} boats placed"
+        else:
+            status = "no solution"
+    elapsed = time.perf_counter() - start_time
+    output = str(result) if result else ""
+
+    return name, output, status, elapsed, limits.as_dict() if metrics else None
+
+
+def difficulty(name: str) -> int:
+    """Returns the rank in DIFFICULTIES of the difficulty the name starts
+    with, hardest first, or one past the last if it starts with none."""
+
+    for rank, prefix in enumerate(DIFFICULTIES):
+        if name.startswith(prefix):
+            return rank
+    return len(DIFFICULTIES)
+
+
+def expected_order(
+    tests: List[Tuple[str, Test]], timings: Dict[str, float]
+) -> List[Tuple[str, Test]]:
+    """Sorts the tests longest expected first. A test is expected to take
+    the time it took before, if known, otherwise the longest time known of
+    a test of the same difficulty, or longer than any known time if there
+    is none; tests expected to take as long go hardest difficulty first."""
+
+    longest = {}  # difficulty -> the longest time known of its tests
+    for name, seconds in timings.items():
+        rank = difficulty(name)
+        longest[rank] = max(seconds, longest.get(rank, seconds))
+
+    def key(test):
+        name = test[0]
+        rank = difficulty(name)
+        expected = timings.get(name, longest.get(rank, float("inf")))
+        return (-expected, rank)
+
+    return sorted(tests, key=key)
+
+
+def solve_all(
+    tests: Iterable[Tuple[str, Test]],
+    jobs: int,
+    timeout: Optional[float] = None,
+    metrics: bool = False,
+    engine: str = "dfs",
+    trace_memory: bool = False,
+) -> Iterator[Result]:
+    """Yields the result of every test as soon as it is solved.
+
+    Tests are taken from the iterable only as they are needed: one at a
+    time with a single job, and with more, so that each worker has at most
+    one test waiting besides the one it is solving. A slow test only ever
+    holds up one core, and the tests never need to be all in memory."""
+
+    if jobs == 1:
+        for name, board in tests:
+            yield solve_instance(name, board, timeout, metrics, engine, trace_memory)
+        return
+
+    tests = iter(tests)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        while True:
+            for name, board in islice(tests, 2 * jobs - len(pending)):
+                pending.add(
+                    executor.submit(
+                        solve_instance,
+                        name,
+                        board,
+                        timeout,
+                        metrics,
+                        engine,
+                        trace_memory,
+                    )
+                )
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def run(
+    files: List[str],
+    results_folder: str,
+    jobs: int = 1,
+    timings_file: Optional[str] = None,
+    timeout: Optional[float] = None,
+    metrics: bool = False,
+    fleet: Optional[List[int]] = None,
+    engine: str = "dfs",
+    trace_memory: bool = False,
+) -> int:
+    """Solves every test in the given files, writing name.out for each of
+    them in the results folder, and prints how long each one took. Returns
+    the number of tests that could not be solved.
+
+    Tests are read only as they are solved. With more than one job they
+    are solved in that many processes, the files named after the hardest
+    difficulties first; given a timings file, every test is read first to
+    solve them longest expected first, and the file is then updated with
+    the new timings. Tests taking longer than timeout
+    seconds, if given, are given up as unsolved. With metrics, the
+    statistics of each search are also written to name.json, including
+    the peak memory it allocated with trace_memory. Tests that do
+    not give their fleet have the given one, Board.FLEET by default. The
+    tests are solved with the given one of the ENGINES."""
+
+    os.makedirs(results_folder, exist_ok=True)
+
+    timings = {}
+    if timings_file and os.path.exists(timings_file):
+        with open(timings_file) as stream:
+            timings = json.load(stream)
+
+    if jobs > 1 and timings_file:
+        # ordering them by their timings needs every test read first
+        tests = expected_order(list(instances(files, fleet)), timings)
+    elif jobs > 1:
+        # the files of the hardest tests first, still read as they are solved
+        files = sorted(files, key=lambda path: difficulty(os.path.basename(path)))
+        tests = instances(files, fleet)
+    else:
+        tests = instances(files, fleet)
+
+    failures = 0
+    solved = 0
+    total_time = 0.0
+    start_time = time.perf_counter()
+
+    for name, output, status, elapsed, statistics in solve_all(
+        tests, jobs, timeout, metrics, engine, trace_memory
+    ):
+        total_time += elapsed
+        timings[name] = elapsed
+
+        output_file_path = os.path.join(results_folder, name + ".out")
+        with open(output_file_path, "w", newline="") as output_file:
+            output_file.write(output)
+
+        if statistics is not None:
+            metrics_file_path = os.path.join(results_folder, name + ".json")
+            with open(metrics_file_path, "w") as metrics_file:
+                json.dump(statistics, metrics_file, indent=1)
+
+        if output:
+            solved += 1
+        else:
+            failures += 1
+
+        print(f"{name}: {status} in {elapsed:.4f} seconds", flush=True)
+
+    wall_time = time.perf_counter() - start_time
+
+    print(
+        f"\n{solved} solved, {failures} unsolved "
+        f"in {total_time:.4f} seconds ({solved + failures} tests)"
+    )
+    if jobs > 1:
+        print(f"{wall_time:.4f} seconds elapsed with {jobs} processes")
+
+    if timings_file:
+        with open(timings_file, "w") as stream:
+            json.dump(timings, stream, indent=1, sort_keys=True)
+
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Solves many Bimaru tests in a single process."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        metavar="PATH",
+        help='directory, glob pattern or test file, "-" for stdin',
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="./out",
+        help="folder where the .out files are written (default: ./out)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--timings",
+        metavar="FILE",
+        help="JSON file with the seconds each test took before, used to "
+        "solve the slowest tests first and updated after the run",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="give up on a test after this many seconds",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="also write the statistics of each search to OUT/name.json",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="with --metrics, also trace the peak memory each search "
+        "allocates (much slower)",
+    )
+    parser.add_argument(
+        "--fleet",
+        type=int,
+        nargs="+",
+        metavar="COUNT",
+        help="number of boats of size 1, 2, 3... for the tests that do not "
+        "give their own fleet (default: 4 3 2 1)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="dfs",
+        help="search algorithm of bimaru.py, or sat for the SAT solver "
+        "(default: dfs)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+
+    try:
+        files = expand_paths(args.paths)
+    except FileNotFoundError as error:
+        parser.error(str(error))
+
+    failures = run(
+        files,
+        args.output,
+        args.jobs,
+        args.timings,
+        args.timeout,
+        args.metrics,
+        args.fleet,
+        args.engine,
+        args.trace_memory,
+    )
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
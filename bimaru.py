@@ -6,55 +6,363 @@
 # 102802 Fabio Mata
 # 103392 Nuno Goncalves
 
+import io
 import sys
-from search import Problem, Node, depth_first_tree_search
-from typing import List, TypeVar, Tuple
+from functools import partial
+from search import (
+    Problem,
+    Node,
+    SearchLimits,
+    SearchMetrics,
+    astar_search,
+    greedy_search,
+    recursive_best_first_search,
+)
+from dlx import ExactCover
+from utils import NogoodStore, TranspositionTable, popcount
+from typing import Callable, Iterator, List, Optional, TypeVar, Tuple
 
 Board = TypeVar("Board", bound="Board")
 
 
 class BimaruState:
+    __slots__ = ("board", "key", "missing", "id")
+
     state_id = 0
 
     def __init__(self, board):
         self.board = board
+        self.key = board.key()
+        self.missing = sum(board.row_hints) + popcount(board.placeholders)
         self.id = BimaruState.state_id
         BimaruState.state_id += 1
 
     def __lt__(self, other):
-        return self.id < other.id
+        """Breaks ties in the best first searches in favour of the board
+        missing fewer boat cells and unresolved placeholders (the
+        Bimaru.h_segments heuristic), then of the one with fewer unknown
+        cells, and then of the older state."""
+
+        return (self.missing, self.board.empty_cells, self.id) < (
+            other.missing,
+            other.board.empty_cells,
+            other.id,
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, BimaruState) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+# (row, col) offsets used by the propagation rules, relative to a boat cell
+AROUND = tuple(
+    (drow, dcol) for drow in (-1, 0, 1) for dcol in (-1, 0, 1) if drow or dcol
+)
+PATTERNS = {
+    "around": AROUND,
+    "diagonals": ((-1, -1), (-1, 1), (1, 1), (1, -1)),
+    "vertical": ((-1, 0), (1, 0)),
+    "horizontal": ((0, -1), (0, 1)),
+    "above": ((-1, 0),),
+    "below": ((1, 0),),
+    "left": ((0, -1),),
+    "right": ((0, 1),),
+    # water around each end segment: every neighbour but the next cell of
+    # the boat, plus the cells diagonal to that next cell
+    "t": tuple(offset for offset in AROUND if offset != (1, 0)) + ((2, -1), (2, 1)),
+    "b": tuple(offset for offset in AROUND if offset != (-1, 0)) + ((-2, -1), (-2, 1)),
+    "l": tuple(offset for offset in AROUND if offset != (0, 1)) + ((-1, 2), (1, 2)),
+    "r": tuple(offset for offset in AROUND if offset != (0, -1)) + ((-1, -2), (1, -2)),
+    # water around a middle segment once the boat direction is known
+    "m_horizontal": tuple((drow, dcol) for drow in (-1, 1) for dcol in range(-2, 3)),
+    "m_vertical": tuple((drow, dcol) for drow in range(-2, 3) for dcol in (-1, 1)),
+}
+
+
+class BoardLayout:
+    """Bit positions and precomputed masks for a board of a given size.
+
+    The cell (row, col) lives in bit (row + 1) * stride + col + 1, where
+    stride is the number of columns plus 2. The outer ring of that grid is
+    never set on a board, so the neighbours of every cell in a mask can be
+    reached by shifting the whole mask, without any bounds checks."""
+
+    layouts = {}  # (rows, columns) -> the layout shared by boards of that size
+
+    @staticmethod
+    def get(rows: int, columns: int) -> "BoardLayout":
+        """Returns the layout for boards of the given size, building it the
+        first time that size is asked for."""
+
+        if (rows, columns) not in BoardLayout.layouts:
+            BoardLayout.layouts[rows, columns] = BoardLayout(rows, columns)
+        return BoardLayout.layouts[rows, columns]
+
+    def __init__(self, rows: int, columns: int):
+        self.rows = rows
+        self.columns = columns
+        self.stride = columns + 2
+
+        self.row_masks = []
+        for row in range(rows):
+            mask = 0
+            for col in range(columns):
+                mask |= self.bit(row, col)
+            self.row_masks.append(mask)
+
+        self.column_masks = []
+        for col in range(columns):
+            mask = 0
+            for row in range(rows):
+                mask |= self.bit(row, col)
+            self.column_masks.append(mask)
+
+        self.cells = 0
+        for mask in self.row_masks:
+            self.cells |= mask
+        self.border = ((1 << (rows + 2) * self.stride) - 1) & ~self.cells
+
+        self.offsets = {
+            name: tuple(drow * self.stride + dcol for drow, dcol in pattern)
+            for name, pattern in PATTERNS.items()
+        }
+        self.placements = {}
+        self.boats = {}  # (row, col, size, direction) -> (cells, halo)
+
+    def __reduce__(self):
+        """Pickles the layout by its size only, so that unpickled boards share
+        the layout cached in their process instead of carrying its tables."""
+
+        return (BoardLayout.get, (self.rows, self.columns))
+
+    def bit(self, row: int, col: int) -> int:
+        """Returns the mask holding only the cell (row, col)."""
+
+        return 1 << ((row + 1) * self.stride + col + 1)
+
+    def position(self, bit: int) -> Tuple[int, int]:
+        """Returns the (row, col) of the lowest cell set in the mask."""
+
+        row, col = divmod(bit.bit_length() - 1, self.stride)
+        return row - 1, col - 1
+
+    def spread(self, mask: int, pattern: str) -> int:
+        """Returns the cells reached by moving every cell of the mask by
+        each of the offsets of the given pattern."""
+
+        result = 0
+        if not mask:
+            return result
+
+        for offset in self.offsets[pattern]:
+            if offset > 0:
+                result |= mask << offset
+            else:
+                result |= mask >> -offset
+
+        return result & self.cells
+
+    def get_placements(
+        self, size: int
+    ) -> List[Tuple[int, int, int, int, int, int, int, int]]:
+        """Returns every position a boat of the given size can take, in the
+        order actions are generated: horizontal boats row by row and then
+        vertical boats column by column (single cell boats only once, in
+        the vertical order).
+
+        Each placement is a tuple (row, col, direction, cells, first,
+        inner, last, halo) of masks of the cells of the boat, of its first,
+        middle and last cells, and of the cells around it. The table is
+        built on first use and kept for every board with this layout."""
+
+        if size not in self.placements:
+            placements = []
+            if size > 1:
+                for row in range(self.rows):
+                    for col in range(self.columns - size + 1):
+                        placements.append(
+                            self.placement(
+                                row, col, size, 0, 1, Board.HORIZONTAL_DIRECTION
+                            )
+                        )
+            for col in range(self.columns):
+                for row in range(self.rows - size + 1):
+                    placements.append(
+                        self.placement(row, col, size, 1, 0, Board.VERTICAL_DIRECTION)
+                    )
+            self.placements[size] = placements
+            for row, col, direction, cells, _, _, _, halo in placements:
+                self.boats[row, col, size, direction] = (cells, halo)
+
+        return self.placements[size]
+
+    def get_boat(
+        self, row: int, col: int, size: int, direction: int
+    ) -> Tuple[int, int]:
+        """Returns the masks of the cells of the boat an action places and of
+        the cells around it, once get_placements was called for its size."""
+
+        return self.boats[row, col, size, direction]
+
+    def placement(
+        self, row: int, col: int, size: int, drow: int, dcol: int, direction: int
+    ) -> Tuple[int, int, int, int, int, int, int, int]:
+        """Returns the placement of a boat of the given size starting at
+        (row, col) and extending along (drow, dcol)."""
+
+        first = self.bit(row, col)
+        last = self.bit(row + (size - 1) * drow, col + (size - 1) * dcol)
+        cells = 0
+        for i in range(size):
+            cells |= self.bit(row + i * drow, col + i * dcol)
+
+        inner = cells & ~first & ~last
+        halo = self.spread(cells, "around") & ~cells
+        return (row, col, direction, cells, first, inner, last, halo)
 
 
 class Board:
-    """Representação interna de um tabuleiro de Bimaru."""
+    """Representação interna de um tabuleiro de Bimaru.
+
+    Each class of cell (water, placeholder and each kind of boat segment) is
+    kept as an integer bitmask over the BoardLayout shared by every board of
+    the same size, which is given by the hints. Cells given as hints are
+    also set in the fixed mask, which is what makes them print in upper
+    case. The changed mask is the worklist of cells whose content changed
+    since the last cleanup.
+
+    boats[size - 1] is the number of boats of each size still to be placed,
+    out of the fleet the puzzle started with."""
 
-    ROWS_NUMBER = 10
-    COLUMNS_NUMBER = 10
     OUT_OF_BOUNDS = "x"
     HORIZONTAL_DIRECTION = 0
     VERTICAL_DIRECTION = 1
+    SEGMENTS = "ctblrm"
+    SEGMENT_INDEX = {symbol: index for index, symbol in enumerate(SEGMENTS)}
+    FLEET = (4, 3, 2, 1)  # number of boats of size 1, 2, 3 and 4
+
+    __slots__ = (
+        "layout",
+        "fleet",
+        "row_hints",
+        "column_hints",
+        "boats",
+        "is_valid",
+        "empty_cells",
+        "water",
+        "placeholders",
+        "segments",
+        "fixed",
+        "changed",
+    )
 
     def __init__(
         self,
         row_hints: List[int],
         column_hints: List[int],
-        board: List[List[str]],
         boats: List[int],
-        empty_cells: int,
+        fleet: Optional[Tuple[int, ...]] = None,
     ):
-        self.board = [[item for item in row] for row in board]
+        self.layout = BoardLayout.get(len(row_hints), len(column_hints))
+        self.fleet = tuple(boats) if fleet is None else tuple(fleet)
         self.row_hints = [item for item in row_hints]
         self.column_hints = [item for item in column_hints]
         self.boats = [count for count in boats]
         self.is_valid = True
-        self.empty_cells = empty_cells
+        self.empty_cells = self.layout.rows * self.layout.columns
+        self.water = 0
+        self.placeholders = 0
+        self.segments = [0, 0, 0, 0, 0, 0]
+        self.fixed = 0
+        self.changed = self.layout.cells
+
+    def copy(self) -> Board:
+        """Returns an independent copy of the board."""
+
+        board = Board.__new__(Board)
+        board.layout = self.layout
+        board.fleet = self.fleet
+        board.row_hints = self.row_hints[:]
+        board.column_hints = self.column_hints[:]
+        board.boats = self.boats[:]
+        board.is_valid = self.is_valid
+        board.empty_cells = self.empty_cells
+        board.water = self.water
+        board.placeholders = self.placeholders
+        board.segments = self.segments[:]
+        board.fixed = self.fixed
+        board.changed = self.changed
+        return board
+
+    def get_boat_cells(self) -> int:
+        """Returns the mask of the cells holding a boat segment."""
+
+        circles, tops, bottoms, lefts, rights, middles = self.segments
+        return circles | tops | bottoms | lefts | rights | middles
+
+    def get_complete_boats(self) -> int:
+        """Returns the mask of the cells of the boats that are complete,
+        which are the ones already discounted from the fleet."""
+
+        circles, tops, bottoms, lefts, rights, middles = self.segments
+        stride = self.layout.stride
+        complete = circles
+
+        # the cells of a horizontal boat are reached from its left end going
+        # right and from its right end going left, through middle segments,
+        # and symmetrically for vertical boats
+        for start, end, step in ((lefts, rights, 1), (tops, bottoms, stride)):
+            forward = reached = start
+            while reached:
+                reached = (reached << step) & (middles | end) & ~forward
+                forward |= reached
+            backward = reached = end
+            while reached:
+                reached = (reached >> step) & (middles | start) & ~backward
+                backward |= reached
+            complete |= forward & backward
+
+        return complete
+
+    def get_unfinished_cells(self) -> int:
+        """Returns the mask of the boat cells that are not part of a
+        complete boat yet: the placeholders and the segments of the boats
+        still missing some of their cells."""
+
+        return self.placeholders | (self.get_boat_cells() & ~self.get_complete_boats())
+
+    def largest_boat(self) -> int:
+        """Returns the largest size with boats still to place, or 0 if the
+        whole fleet was placed."""
+
+        size = len(self.boats)
+        while size > 0 and not self.boats[size - 1]:
+            size -= 1
+        return size
+
+    def get_empty_cells(self) -> int:
+        """Returns the mask of the cells that are still unknown."""
+
+        return self.layout.cells & ~(
+            self.water | self.placeholders | self.get_boat_cells()
+        )
 
     def get_value(self, row: int, col: int) -> str:
         """Devolve o valor na respetiva posição do tabuleiro."""
 
-        if row >= 0 and row <= Board.ROWS_NUMBER - 1:
-            if col >= 0 and col <= Board.COLUMNS_NUMBER - 1:
-                return self.board[row][col]
+        if 0 <= row < self.layout.rows:
+            if 0 <= col < self.layout.columns:
+                bit = self.layout.bit(row, col)
+                if self.water & bit:
+                    return "W" if self.fixed & bit else "w"
+                if self.placeholders & bit:
+                    return "$"
+                for symbol, mask in zip(Board.SEGMENTS, self.segments):
+                    if mask & bit:
+                        return symbol.upper() if self.fixed & bit else symbol
+                return ""
 
         return Board.OUT_OF_BOUNDS
 
@@ -62,18 +370,66 @@ class Board:
         """Places the given symbol in the given position if valid,
         does nothing otherwise."""
 
-        if row >= 0 and row <= Board.ROWS_NUMBER - 1:
-            if col >= 0 and col <= Board.COLUMNS_NUMBER - 1:
-                prev_symbol = self.get_value(row, col)
-                if prev_symbol != symbol.upper():
-                    if prev_symbol == "":
-                        self.empty_cells -= 1
-
-                    if prev_symbol not in ("$", "m") and symbol not in ("w", "W"):
-                        self.row_hints[row] -= 1
-                        self.column_hints[col] -= 1
-
-                    self.board[row][col] = symbol
+        if 0 <= row < self.layout.rows:
+            if 0 <= col < self.layout.columns:
+                bit = self.layout.bit(row, col)
+                if symbol.isupper():
+                    self.fixed |= bit
+
+                symbol = symbol.lower()
+                if symbol == "w":
+                    self.fill(bit, 0)
+                elif symbol == "$":
+                    self.fill(0, bit)
+                else:
+                    self.place_segment(symbol, bit)
+
+    def fill(self, water: int, placeholders: int):
+        """Marks the empty cells of the given masks as water and as
+        placeholders, respectively. The board becomes invalid if a cell
+        would hold water and a boat at the same time."""
+
+        boats = self.placeholders | self.get_boat_cells()
+        if water & (boats | placeholders) or placeholders & self.water:
+            self.is_valid = False
+            return
+
+        water &= ~self.water
+        placeholders &= ~boats
+        self.water |= water
+        self.placeholders |= placeholders
+        self.changed |= water | placeholders
+        self.empty_cells -= popcount(water) + popcount(placeholders)
+        self.claim(placeholders)
+
+    def place_segment(self, symbol: str, mask: int):
+        """Places the given boat segment on the cells of the mask, which
+        must either be empty, placeholders or already hold that segment."""
+
+        index = Board.SEGMENT_INDEX[symbol]
+        segment = self.segments[index]
+        if mask & (self.water | (self.get_boat_cells() & ~segment)):
+            self.is_valid = False
+            return
+
+        mask &= ~segment
+        new_cells = mask & ~self.placeholders
+        self.placeholders &= ~mask
+        self.segments[index] = segment | mask
+        self.changed |= mask
+        self.empty_cells -= popcount(new_cells)
+        self.claim(new_cells)
+
+    def claim(self, mask: int):
+        """Discounts the newly occupied cells of the mask from the row and
+        column hints."""
+
+        while mask:
+            bit = mask & -mask
+            row, col = self.layout.position(bit)
+            self.row_hints[row] -= 1
+            self.column_hints[col] -= 1
+            mask ^= bit
 
     def adjacent_vertical_values(self, row: int, col: int) -> Tuple[str, str]:
         """Devolve os valores imediatamente acima e abaixo,
@@ -102,592 +458,572 @@ class Board:
     def get_boats_row(self, row) -> int:
         """Returns the number of boat cells in a row"""
 
-        count = 0
-        for col in range(Board.COLUMNS_NUMBER):
-            if self.get_value(row, col) not in ("", "w", "W", Board.OUT_OF_BOUNDS):
-                count += 1
-
-        return count
+        boats = self.placeholders | self.get_boat_cells()
+        return popcount(boats & self.layout.row_masks[row])
 
     def get_boats_col(self, col) -> int:
         """Returns the number of boat cells in a column"""
 
-        count = 0
-        for row in range(Board.ROWS_NUMBER):
-            if self.get_value(row, col) not in ("", "w", "W", Board.OUT_OF_BOUNDS):
-                count += 1
-
-        return count
+        boats = self.placeholders | self.get_boat_cells()
+        return popcount(boats & self.layout.column_masks[col])
 
     def is_goal(self) -> bool:
         """Returns True if the board is solved"""
 
-        hints = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
-
         return (
-            self.empty_cells == 0
-            and self.boats == [0, 0, 0, 0]
-            and self.row_hints == hints
-            and self.column_hints == hints
+            self.is_valid
+            and self.empty_cells == 0
+            and not any(self.boats)
+            and not any(self.row_hints)
+            and not any(self.column_hints)
         )
 
-    def process_cell(self, row: int, col: int):
-        """Places water and $ around the given cell
-        accordingly to the symbol it holds."""
-
-        symbol = self.board[row][col]
-
-        if symbol in ("C", "c"):
-            self.process_C(row, col)
-        elif symbol in ("M", "m"):
-            self.process_M(row, col)
-        elif symbol in ("T", "t", "B", "b"):
-            self.process_T_B(symbol, row, col)
-        elif symbol in ("L", "l", "R", "r"):
-            self.process_L_R(symbol, row, col)
-        elif symbol == "$":
-            self.process_placeholder(row, col)
-
-    def process_T_B(self, symbol: str, row: int, col: int):
-        """Places water and placeholders around T and B cells if possible"""
-
-        # upper row
-        self.place_symbol("w", row - 1, col - 1)
-        # only cover the cell above the symbol if it's T
-        if symbol in ("T", "t"):
-            self.place_symbol("w", row - 1, col)
-        elif self.get_value(row - 1, col) == "":
-            self.place_symbol("$", row - 1, col)
-        self.place_symbol("w", row - 1, col + 1)
-
-        # only cover the further side cells above the symbol if it's B
-        if symbol in ("B", "b"):
-            self.place_symbol("w", row - 2, col - 1)
-            self.place_symbol("w", row - 2, col + 1)
-
-        # to the left
-        self.place_symbol("w", row, col - 1)
-
-        # to the right
-        self.place_symbol("w", row, col + 1)
-
-        # inferior row
-        self.place_symbol("w", row + 1, col - 1)
-        # only cover the cell underneath the symbol if it's B
-        if symbol in ("B", "b"):
-            self.place_symbol("w", row + 1, col)
-        elif self.get_value(row + 1, col) == "":
-            self.place_symbol("$", row + 1, col)
-        self.place_symbol("w", row + 1, col + 1)
-
-        # only cover the further side cells underneath the symbol if it's T
-        if symbol in ("T", "t"):
-            self.place_symbol("w", row + 2, col - 1)
-            self.place_symbol("w", row + 2, col + 1)
-
-    def process_L_R(self, symbol: str, row: int, col: int):
-        """Places water and placeholders around L and R cells if possible"""
-
-        # upper row
-        # only cover the further left side cell above the symbol if it's R
-        if symbol in ("R", "r"):
-            self.place_symbol("w", row - 1, col - 2)
-        self.place_symbol("w", row - 1, col - 1)
-        self.place_symbol("w", row - 1, col)
-        self.place_symbol("w", row - 1, col + 1)
-        # only cover the further right side cell above the symbol if it's L
-        if symbol in ("L", "l"):
-            self.place_symbol("w", row - 1, col + 2)
-
-        # to the right
-        if symbol in ("R", "r"):
-            self.place_symbol("w", row, col + 1)
-        elif self.get_value(row, col + 1) == "":
-            self.place_symbol("$", row, col + 1)
-
-        # to the left
-        if symbol in ("L", "l"):
-            self.place_symbol("w", row, col - 1)
-        elif self.get_value(row, col - 1) == "":
-            self.place_symbol("$", row, col - 1)
-
-        # inferior row
-        # only cover the further left side cell underneath the symbol if it's R
-        if symbol in ("R", "r"):
-            self.place_symbol("w", row + 1, col - 2)
-        self.place_symbol("w", row + 1, col - 1)
-        self.place_symbol("w", row + 1, col)
-        self.place_symbol("w", row + 1, col + 1)
-        # only cover the further right side cell underneath the symbol if it's L
-        if symbol in ("L", "l"):
-            self.place_symbol("w", row + 1, col + 2)
-
-    def process_C(self, row: int, col: int):
-        """Places water and placeholders around C cells if possible"""
-
-        # upper row
-        self.place_symbol("w", row - 1, col - 1)
-        self.place_symbol("w", row - 1, col)
-        self.place_symbol("w", row - 1, col + 1)
-        # to the left
-        self.place_symbol("w", row, col - 1)
-        # to the right
-        self.place_symbol("w", row, col + 1)
-        # inferior row
-        self.place_symbol("w", row + 1, col - 1)
-        self.place_symbol("w", row + 1, col)
-        self.place_symbol("w", row + 1, col + 1)
-
-    def process_M(self, row: int, col: int):
-        """Places water and placeholders around M cells if possible"""
-
-        vertical_adj_values = self.adjacent_vertical_values(row, col)
-        horizontal_adj_values = self.adjacent_horizontal_values(row, col)
-
-        # place water diagonally
-        self.place_symbol("w", row - 1, col - 1)
-        self.place_symbol("w", row - 1, col + 1)
-        self.place_symbol("w", row + 1, col + 1)
-        self.place_symbol("w", row + 1, col - 1)
-
-        # check if M is part of a horizontally displayed ship
-        if (
-            "W" in vertical_adj_values
-            or "w" in vertical_adj_values
-            or row == Board.ROWS_NUMBER - 1
-            or row == 0
-            or any(
-                map(
-                    lambda x: x not in ("", "W", "w", Board.OUT_OF_BOUNDS),
-                    horizontal_adj_values,
-                )
+    def process_cells(self, changed: int):
+        """Places water and $ around the boat cells that can be affected
+        by the changed cells, accordingly to the symbol they hold."""
+
+        layout = self.layout
+        spread = layout.spread
+
+        # the cells around an unchanged boat cell were already filled when
+        # it was processed, and anything placed on them since then was
+        # checked against them, so only the changed cells need processing.
+        # The exception are middle segments, whose direction may only be
+        # known once one of their neighbours changes.
+        circles, tops, bottoms, lefts, rights, middles = self.segments
+        circles &= changed
+        tops &= changed
+        bottoms &= changed
+        lefts &= changed
+        rights &= changed
+        middles &= changed | spread(changed, "around")
+        placeholders = self.placeholders & changed
+
+        horizontal = vertical = 0
+        if middles:
+            # a middle segment is part of a horizontal boat if there is water
+            # (or the border) above or below it, or a boat cell next to it,
+            # and symmetrically for vertical boats
+            water = self.water | layout.border
+            boats = self.placeholders | self.get_boat_cells()
+            horizontal = middles & (
+                spread(water, "vertical") | spread(boats, "horizontal")
             )
-        ):
-            if horizontal_adj_values[0] == "":
-                self.place_symbol("$", row, col - 1)
-            if horizontal_adj_values[1] == "":
-                self.place_symbol("$", row, col + 1)
-            for i in (row - 1, row + 1):
-                for j in (col - 2, col - 1, col, col + 1, col + 2):
-                    self.place_symbol("w", i, j)
-        # check if M is part of a vertically displayed ship
-        elif (
-            "W" in horizontal_adj_values
-            or "w" in horizontal_adj_values
-            or col == Board.COLUMNS_NUMBER - 1
-            or col == 0
-            or any(
-                map(
-                    lambda x: x not in ("", "W", "w", Board.OUT_OF_BOUNDS),
-                    vertical_adj_values,
-                )
+            vertical = (
+                middles
+                & ~horizontal
+                & (spread(water, "horizontal") | spread(boats, "vertical"))
             )
-        ):
-            if vertical_adj_values[0] == "":
-                self.place_symbol("$", row - 1, col)
-            if vertical_adj_values[1] == "":
-                self.place_symbol("$", row + 1, col)
-            for i in (row - 2, row - 1, row, row + 1, row + 2):
-                for j in (col - 1, col + 1):
-                    self.place_symbol("w", i, j)
-
-    def process_placeholder(self, row: int, col: int):
-        """Places water around placeholder cells if possible"""
-
-        # diagonals
-        self.place_symbol("w", row - 1, col - 1)
-        self.place_symbol("w", row - 1, col + 1)
-        self.place_symbol("w", row + 1, col + 1)
-        self.place_symbol("w", row + 1, col - 1)
-
-    def place_water_row(self, row: int):
-        """Fills empty cells of a row with water if possible"""
-
-        if self.row_hints[row] == 0:
-            for col in range(Board.COLUMNS_NUMBER):
-                if self.board[row][col] == "":
-                    self.place_symbol("w", row, col)
-
-    def place_water_column(self, col: int):
-        """Fills empty cells of a column with water if possible"""
-
-        if self.column_hints[col] == 0:
-            for row in range(Board.ROWS_NUMBER):
-                if self.board[row][col] == "":
-                    self.place_symbol("w", row, col)
-
-    def place_boats_row(self, row: int):
-        """Fills empty cells of a row with placeholders if possible"""
-
-        empty_counter = 0
-        for col in range(Board.COLUMNS_NUMBER):
-            if self.board[row][col] == "":
-                empty_counter += 1
-
-        if empty_counter == self.row_hints[row]:
-            for col in range(Board.COLUMNS_NUMBER):
-                if self.board[row][col] == "":
-                    self.place_symbol("$", row, col)
-
-    def place_boats_column(self, col: int):
-        """Fills empty cells of a column with placeholders if possible"""
-
-        empty_counter = 0
-        for row in range(Board.ROWS_NUMBER):
-            if self.board[row][col] == "":
-                empty_counter += 1
-
-        if empty_counter == self.column_hints[col]:
-            for row in range(Board.ROWS_NUMBER):
-                if self.board[row][col] == "":
-                    self.place_symbol("$", row, col)
+
+        # (cells, pattern of the water around them, pattern of the boat
+        # cells that must follow them)
+        rules = (
+            (circles, "around", None),
+            (tops, "t", "below"),
+            (bottoms, "b", "above"),
+            (lefts, "l", "right"),
+            (rights, "r", "left"),
+            (middles | placeholders, "diagonals", None),
+            (horizontal, "m_horizontal", "horizontal"),
+            (vertical, "m_vertical", "vertical"),
+        )
+
+        water = boats = 0
+        for cells, water_pattern, boat_pattern in rules:
+            if cells:
+                water |= spread(cells, water_pattern)
+                if boat_pattern:
+                    boats |= spread(cells, boat_pattern)
+
+        self.fill(water, boats)
+
+    def process_lines(self, rows: List[int], columns: List[int]):
+        """Fills the empty cells of the given rows and columns with water
+        when their hint is met, and with placeholders when only the empty
+        cells are left to meet it."""
+
+        layout = self.layout
+        empty = self.get_empty_cells()
+
+        water = 0
+        for row in rows:
+            if self.row_hints[row] == 0:
+                water |= layout.row_masks[row]
+        for col in columns:
+            if self.column_hints[col] == 0:
+                water |= layout.column_masks[col]
+        water &= empty
+        empty &= ~water
+
+        placeholders = 0
+        for row in rows:
+            hint = self.row_hints[row]
+            cells = empty & layout.row_masks[row]
+            if hint > 0 and popcount(cells) == hint:
+                placeholders |= cells
+        for col in columns:
+            hint = self.column_hints[col]
+            cells = empty & layout.column_masks[col]
+            if hint > 0 and popcount(cells) == hint:
+                placeholders |= cells
+
+        self.fill(water, placeholders)
 
     def place_boat(self, row: int, col: int, size: int, direction: int) -> Board:
         """Receives an action and places a boat with the given size and direction on the position (row, col)"""
 
-        new_board = Board(
-            self.row_hints, self.column_hints, self.board, self.boats, self.empty_cells
-        )
+        new_board = self.copy()
+        new_board.apply_boat(row, col, size, direction)
+        return new_board
+
+    def apply_boat(self, row: int, col: int, size: int, direction: int):
+        """Places a boat like place_boat, but on this board instead of on a
+        copy of it."""
 
         if size == 1:
-            new_board.place_symbol("c", row, col)
+            self.place_symbol("c", row, col)
 
-            new_board.boats[size - 1] -= 1
-            new_board.cleanup()
-            return new_board
+            self.boats[size - 1] -= 1
+            self.cleanup()
+            return
 
         for i in range(0, size):
             if direction == Board.HORIZONTAL_DIRECTION:
                 if i == 0:
-                    new_board.place_symbol("l", row, col)
+                    self.place_symbol("l", row, col)
                 elif i == size - 1:
-                    new_board.place_symbol("r", row, col)
+                    self.place_symbol("r", row, col)
                 else:
-                    new_board.place_symbol("m", row, col)
+                    self.place_symbol("m", row, col)
 
                 col += 1
 
             elif direction == Board.VERTICAL_DIRECTION:
                 if i == 0:
-                    new_board.place_symbol("t", row, col)
+                    self.place_symbol("t", row, col)
                 elif i == size - 1:
-                    new_board.place_symbol("b", row, col)
+                    self.place_symbol("b", row, col)
                 else:
-                    new_board.place_symbol("m", row, col)
+                    self.place_symbol("m", row, col)
 
                 row += 1
 
-        new_board.boats[size - 1] -= 1
-        new_board.cleanup()
-        return new_board
+        self.boats[size - 1] -= 1
+        self.cleanup()
 
-    def calculate_placeable_boats(self) -> List[Tuple[int, int, int, int, int]]:
-        """Calculates all possible actions"""
+    def key(self) -> tuple:
+        """Returns the contents of the board and the boats still to place,
+        which are the same for every board that is in the same state no
+        matter the order in which its boats were placed."""
 
-        if not self.is_valid:
-            return []
+        return (self.water, self.placeholders, *self.segments, *self.boats)
 
-        placeable_boats = []
-        size = 4
+    def save(self) -> tuple:
+        """Returns everything placing boats can change on the board, so that
+        it can later be undone with restore."""
 
-        while size > 0 and self.boats[size - 1] == 0:
-            size -= 1
-
-        if size == 0:
-            return []
+        return (
+            self.water,
+            self.placeholders,
+            tuple(self.segments),
+            tuple(self.row_hints),
+            tuple(self.column_hints),
+            tuple(self.boats),
+            self.empty_cells,
+            self.is_valid,
+            self.changed,
+        )
 
-        possible_circles = []
+    def restore(self, saved: tuple):
+        """Brings the board back to the state returned by save."""
+
+        (
+            self.water,
+            self.placeholders,
+            segments,
+            row_hints,
+            column_hints,
+            boats,
+            self.empty_cells,
+            self.is_valid,
+            self.changed,
+        ) = saved
+        self.segments[:] = segments
+        self.row_hints[:] = row_hints
+        self.column_hints[:] = column_hints
+        self.boats[:] = boats
+
+    def calculate_placeable_boats(
+        self, size: Optional[int] = None
+    ) -> List[Tuple[int, int, int, int, int]]:
+        """Calculates all possible actions
+
+        Each action (row, col, size, direction, slack) places a boat of the
+        largest size still to place, or of the given size, and the actions
+        are sorted by how many boat cells its line has left after it."""
 
-        # horizontal
-        for row in range(Board.ROWS_NUMBER):
-            total_boats = self.get_boats_row(row)
+        if not self.is_valid:
+            return []
 
-            if size - total_boats > self.row_hints[row]:
-                continue
+        if size is None:
+            size = self.largest_boat()
 
-            for col in range(Board.COLUMNS_NUMBER):
-                override_count = 0
-
-                if self.get_value(row, col) in (
-                    "",
-                    "$",
-                    "L",
-                ) and self.get_value(
-                    row, col - 1
-                ) not in ("$", "L", "M"):
-                    if self.get_value(row, col) != "":
-                        override_count += 1
-
-                    i = 1
-                    while i < size and self.get_value(row, col + i) in (
-                        "",
-                        "$",
-                        "M",
-                    ):
-                        if self.get_value(row, col + i) != "":
-                            override_count += 1
-
-                        i += 1
-
-                    if (
-                        i == size - 1
-                        and self.get_value(row, col + i) == "R"
-                        and size - 1 - override_count <= self.row_hints[row]
-                    ):
-                        placeable_boats.append(
-                            (
-                                row,
-                                col,
-                                size,
-                                Board.HORIZONTAL_DIRECTION,
-                                self.row_hints[row] - (size - 1 - override_count),
-                            )
-                        )
+        if size == 0 or self.boats[size - 1] == 0:
+            return []
 
-                    if (
-                        i == size
-                        and self.get_value(row, col + i)
-                        in ("", "w", "W", Board.OUT_OF_BOUNDS)
-                        and self.get_value(row, col + i + 1) != "R"
-                        and size - override_count <= self.row_hints[row]
-                    ):
-                        if size == 1 and self.get_value(row, col) in ("", "$"):
-                            possible_circles.append((row, col))
-                        elif size != 1 and self.get_value(row, col + i - 1) in (
-                            "",
-                            "$",
-                            "R",
-                        ):
-                            placeable_boats.append(
-                                (
-                                    row,
-                                    col,
-                                    size,
-                                    Board.HORIZONTAL_DIRECTION,
-                                    self.row_hints[row] - (size - override_count),
-                                )
-                            )
+        layout = self.layout
+        circles, tops, bottoms, lefts, rights, middles = self.segments
+        empty = self.get_empty_cells()
+        free = empty | self.placeholders
+        boats = self.placeholders | self.get_boat_cells()
+
+        # only lines that, counting the boat cells they already hold, have
+        # room for a boat of this size
+        rows = [
+            size - popcount(boats & mask) <= hint
+            for mask, hint in zip(layout.row_masks, self.row_hints)
+        ]
+        columns = [
+            size - popcount(boats & mask) <= hint
+            for mask, hint in zip(layout.column_masks, self.column_hints)
+        ]
+
+        # cells each part of a boat can take: the empty cells, placeholders
+        # and the hints of a boat that is not complete yet
+        starts = (free | (lefts & self.fixed), free | (tops & self.fixed))
+        ends = (free | (rights & self.fixed), free | (bottoms & self.fixed))
+        inners = free | (middles & self.fixed)
 
-        # vertical
-        for col in range(Board.COLUMNS_NUMBER):
-            total_boats = self.get_boats_col(col)
+        placeable_boats = []
 
-            if size - total_boats > self.column_hints[col]:
+        for (
+            row,
+            col,
+            direction,
+            cells,
+            first,
+            inner,
+            last,
+            halo,
+        ) in layout.get_placements(size):
+            # a boat can't touch other boats
+            if halo & boats:
                 continue
 
-            for row in range(Board.ROWS_NUMBER):
-                override_count = 0
-
-                if self.get_value(row, col) in (
-                    "",
-                    "$",
-                    "T",
-                ) and self.get_value(
-                    row - 1, col
-                ) not in ("$", "T", "M"):
-                    if self.get_value(row, col) != "":
-                        override_count += 1
-
-                    i = 1
-                    while i < size and self.get_value(row + i, col) in (
-                        "",
-                        "$",
-                        "M",
-                    ):
-                        if self.get_value(row + i, col) != "":
-                            override_count += 1
-
-                        i += 1
-
-                    if (
-                        i == size - 1
-                        and self.get_value(row + i, col) == "B"
-                        and size - 1 - override_count <= self.column_hints[col]
-                    ):
-                        placeable_boats.append(
-                            (
-                                row,
-                                col,
-                                size,
-                                Board.VERTICAL_DIRECTION,
-                                self.column_hints[col] - (size - 1 - override_count),
-                            )
-                        )
+            if size == 1:
+                if not (cells & free and rows[row] and columns[col]):
+                    continue
+
+                new_cells = popcount(cells & empty)
+                if new_cells > self.row_hints[row]:
+                    continue
+                hint = self.column_hints[col]
+
+            else:
+                if (
+                    not first & starts[direction]
+                    or not last & ends[direction]
+                    or inner & ~inners
+                ):
+                    continue
+
+                if direction == Board.HORIZONTAL_DIRECTION:
+                    if not rows[row]:
+                        continue
+                    hint = self.row_hints[row]
+                else:
+                    if not columns[col]:
+                        continue
+                    hint = self.column_hints[col]
 
-                    if (
-                        i == size
-                        and self.get_value(row + i, col)
-                        in ("", "w", "W", Board.OUT_OF_BOUNDS)
-                        and self.get_value(row + i + 1, col) != "B"
-                        and size - override_count <= self.column_hints[col]
-                    ):
-                        if size == 1 and self.get_value(row, col) in ("", "$"):
-                            if (row, col) in possible_circles:
-                                placeable_boats.append(
-                                    (
-                                        row,
-                                        col,
-                                        size,
-                                        Board.VERTICAL_DIRECTION,
-                                        self.column_hints[col]
-                                        - (size - override_count),
-                                    )
-                                )
-                        elif size != 1 and self.get_value(row + i - 1, col) in (
-                            "",
-                            "$",
-                            "B",
-                        ):
-                            placeable_boats.append(
-                                (
-                                    row,
-                                    col,
-                                    size,
-                                    Board.VERTICAL_DIRECTION,
-                                    self.column_hints[col] - (size - override_count),
-                                )
-                            )
+                new_cells = popcount(cells & empty)
+
+            if new_cells <= hint:
+                placeable_boats.append((row, col, size, direction, hint - new_cells))
 
         return sorted(placeable_boats, key=lambda action: action[4])
 
-    def replace_placeholders(self):
-        """Replaces placeholders with the respective boat if possible"""
-
-        for row in range(Board.ROWS_NUMBER):
-            for col in range(Board.COLUMNS_NUMBER):
-                if self.get_value(row, col) == "$":
-                    if self.adjacent_horizontal_values(row, col)[0] == "L" or (
-                        self.adjacent_horizontal_values(row, col)[1]
-                        not in ("", "w", "W", Board.OUT_OF_BOUNDS)
-                        and self.adjacent_horizontal_values(row, col)[0]
-                        not in ("", "$", "M")
-                    ):
-                        size = 0
-                        i = 1
-                        while self.get_value(row, col + i) in ("$", "m", "M"):
-                            i += 1
-
-                        if self.get_value(row, col + i) in (
-                            "w",
-                            "W",
-                            Board.OUT_OF_BOUNDS,
-                        ):
-                            self.place_symbol("r", row, col + i - 1)
-                            i -= 1
-
-                        if self.get_value(row, col + i) in ("r", "R"):
-                            size = 1
-                            while self.get_value(row, col + i - 1) in ("$", "m", "M"):
-                                self.place_symbol("m", row, col + i - 1)
-                                i -= 1
-                                size += 1
-
-                            if self.get_value(row, col + i - 1) != "L":
-                                self.place_symbol("l", row, col + i)
-                            elif self.get_value(row, col + i - 1) == "L":
-                                size += 1
-
-                        if size > 1 and size < 5:
-                            if self.boats[size - 1] == 0:
-                                self.is_valid = False
-                            else:
-                                self.boats[size - 1] -= 1
-                        elif size >= 5:
-                            self.is_valid = False
-
-                    elif self.adjacent_vertical_values(row, col)[0] == "T" or (
-                        self.adjacent_vertical_values(row, col)[1]
-                        not in ("", "w", "W", Board.OUT_OF_BOUNDS)
-                        and self.adjacent_vertical_values(row, col)[0]
-                        not in ("", "$", "M")
-                    ):
-                        size = 0
-                        i = 1
-                        while self.get_value(row + i, col) in ("$", "m", "M"):
-                            i += 1
-
-                        if self.get_value(row + i, col) in (
-                            "w",
-                            "W",
-                            Board.OUT_OF_BOUNDS,
-                        ):
-                            self.place_symbol("b", row + i - 1, col)
-                            i -= 1
-
-                        if self.get_value(row + i, col) in ("b", "B"):
-                            size = 1
-                            while self.get_value(row + i - 1, col) in (
-                                "$",
-                                "m",
-                                "M",
-                            ):
-                                self.place_symbol("m", row + i - 1, col)
-                                i -= 1
-                                size += 1
-
-                            if self.get_value(row + i - 1, col) != "T":
-                                self.place_symbol("t", row + i, col)
-                            elif self.get_value(row + i - 1, col) == "T":
-                                size += 1
-
-                        if size > 0 and size < 5:
-                            if self.boats[size - 1] == 0:
-                                self.is_valid = False
-                            else:
-                                self.boats[size - 1] -= 1
-                        elif size >= 5:
-                            self.is_valid = False
-
-                    elif (
-                        all(
-                            value in ("w", "W", Board.OUT_OF_BOUNDS)
-                            for value in self.adjacent_horizontal_values(row, col)
-                        )
-                        and all(
-                            value in ("w", "W", Board.OUT_OF_BOUNDS)
-                            for value in self.adjacent_vertical_values(row, col)
-                        )
-                        and all(
-                            value in ("w", "W", Board.OUT_OF_BOUNDS)
-                            for value in self.adjacent_diagonal_values(row, col)
-                        )
-                    ):
-                        self.place_symbol("c", row, col)
-                        if self.boats[0] == 0:
-                            self.is_valid = False
-                        else:
-                            self.boats[0] -= 1
+    def calculate_constrained_boats(
+        self, variables: str = "forced", values: str = "slack"
+    ) -> List[Tuple[int, int, int, int, int]]:
+        """Calculates the actions like calculate_placeable_boats, choosing
+        what to branch on and in which order to try the actions.
 
-    def cleanup(self):
-        """Places water, placeholders and replaces placeholders if possible"""
+        With variables "forced", the actions are those of a boat cell that
+        is not part of a complete boat yet and that only one action can
+        finish, or else those of the largest boats still to place. With
+        "fewest" (MRV), they are those of whichever choice has the fewest:
+        a size still to place, such a boat cell, or a row or column still
+        missing boat cells, by the actions over its empty cells.
+
+        With values "slack", the actions keep the order of
+        calculate_placeable_boats; with "eliminated", those that rule out
+        the fewest other actions, by taking or touching their cells, are
+        tried first. Depth first search tries the last action first.
 
-        while True:
-            empty_cells = self.empty_cells
+        No actions are returned as soon as a size or an unfinished boat
+        cell has none, or as a row or column can no longer get as many boat
+        cells as its hint (fail first)."""
 
-            for i in range(Board.ROWS_NUMBER):
-                for j in range(Board.COLUMNS_NUMBER):
-                    self.process_cell(i, j)
+        if not self.is_valid:
+            return []
 
-            for i in range(Board.ROWS_NUMBER):
-                self.place_water_row(i)
-                self.place_water_column(i)
-                self.place_boats_row(i)
-                self.place_boats_column(i)
+        layout = self.layout
+
+        groups = []  # the actions of each size still to place, largest first
+        candidates = []  # (action, cells)
+        for size in range(len(self.boats), 0, -1):
+            if self.boats[size - 1]:
+                group = self.calculate_placeable_boats(size)
+                if not group:
+                    return []
+                groups.append(group)
+                for action in group:
+                    candidates.append((action, layout.get_boat(*action[:4])[0]))
+
+        empty = self.get_empty_cells()
+        reachable = 0
+        for _, cells in candidates:
+            reachable |= cells
+        reachable &= empty
+
+        lines = []  # the masks of the rows and columns still missing boat cells
+        for masks, hints in (
+            (layout.row_masks, self.row_hints),
+            (layout.column_masks, self.column_hints),
+        ):
+            for mask, hint in zip(masks, hints):
+                if hint and popcount(reachable & mask) < hint:
+                    return []
+                if hint:
+                    lines.append(mask & empty)
+
+        unfinished = self.get_unfinished_cells()
+        forced = None
+        while unfinished:
+            bit = unfinished & -unfinished
+            unfinished ^= bit
+            finishing = [action for action, cells in candidates if cells & bit]
+            if not finishing:
+                return []
+            if variables == "fewest":
+                groups.append(finishing)
+            elif forced is None and len(finishing) == 1:
+                forced = finishing
+
+        if variables == "fewest":
+            for mask in lines:
+                groups.append([action for action, cells in candidates if cells & mask])
+            actions = sorted(min(groups, key=len), key=lambda action: action[4])
+        else:
+            actions = (forced or groups[0]) if groups else []
+
+        if values == "eliminated":
+            around = {
+                action: cells | layout.get_boat(*action[:4])[1]
+                for action, cells in candidates
+            }
+            actions = sorted(
+                actions,
+                key=lambda action: -sum(
+                    1 for _, cells in candidates if cells & around[action]
+                ),
+            )
 
-            self.replace_placeholders()
+        return actions
+
+    def replace_placeholders(self, candidates: int):
+        """Replaces the placeholders among the candidate cells with the
+        respective boat if possible"""
+
+        placeholders = self.placeholders & candidates
+        if not placeholders:
+            return
+
+        layout = self.layout
+        spread = layout.spread
+        circles, tops, bottoms, lefts, rights, middles = self.segments
+        boat_cells = self.get_boat_cells()
+        boats = self.placeholders | boat_cells
+
+        # a placeholder starts a horizontal boat if it follows an L hint, or
+        # if it is followed by a boat cell and preceded by water, the border
+        # or a segment other than an M hint; and symmetrically for vertical
+        # boats. A placeholder with only water around it is a single cell boat
+        before = self.water | layout.border | (boat_cells & ~(middles & self.fixed))
+        horizontal = spread(lefts & self.fixed, "right") | (
+            spread(boats, "left") & spread(before, "right")
+        )
+        vertical = spread(tops & self.fixed, "below") | (
+            spread(boats, "above") & spread(before, "below")
+        )
+        single = layout.cells & ~spread(layout.cells & ~self.water, "around")
+
+        placeholders &= horizontal | vertical | single
+        while placeholders:
+            bit = placeholders & -placeholders
+            placeholders ^= bit
+            if not self.placeholders & bit:
+                # already replaced as part of a previous boat
+                continue
 
-            for i in range(Board.ROWS_NUMBER):
-                self.place_water_row(i)
-                self.place_water_column(i)
-                self.place_boats_row(i)
-                self.place_boats_column(i)
+            row, col = layout.position(bit)
+            if horizontal & bit:
+                self.complete_boat(row, col, 0, 1)
+            elif vertical & bit:
+                self.complete_boat(row, col, 1, 0)
+            else:
+                self.place_symbol("c", row, col)
+                self.count_boat(1)
+
+    def complete_boat(self, row: int, col: int, drow: int, dcol: int):
+        """Replaces the placeholders of the boat that starts at (row, col)
+        and extends along (drow, dcol), if the cell after them closes it."""
+
+        first, last = ("l", "r") if dcol else ("t", "b")
+
+        start = 0
+        if self.get_value(row - drow, col - dcol) == first.upper():
+            start = -1
+
+        end = 1
+        while self.get_value(row + end * drow, col + end * dcol) in ("$", "m", "M"):
+            end += 1
+
+        value = self.get_value(row + end * drow, col + end * dcol)
+        if value in ("w", "W", Board.OUT_OF_BOUNDS):
+            end -= 1
+        elif value not in (last, last.upper()):
+            return
+
+        if end == start:
+            return
+
+        for i in range(start, end + 1):
+            if i == start:
+                symbol = first
+            elif i == end:
+                symbol = last
+            else:
+                symbol = "m"
+            self.place_symbol(symbol, row + i * drow, col + i * dcol)
+
+        self.count_boat(end - start + 1)
+
+    def count_boat(self, size: int):
+        """Discounts a completed boat of the given size from the fleet."""
+
+        if size > len(self.boats) or self.boats[size - 1] == 0:
+            self.is_valid = False
+        else:
+            self.boats[size - 1] -= 1
 
-            for i in range(Board.ROWS_NUMBER):
-                for j in range(Board.COLUMNS_NUMBER):
-                    self.process_cell(i, j)
+    def cleanup(self):
+        """Places water, placeholders and replaces placeholders if possible.
+
+        Only the rules that can be affected by the cells changed since the
+        last call are run again, and the cells they change are queued in
+        turn until nothing else can be inferred."""
+
+        layout = self.layout
+
+        while self.is_valid and self.changed:
+            changed = self.changed
+            self.changed = 0
+
+            rows = [row for row, mask in enumerate(layout.row_masks) if changed & mask]
+            columns = [
+                col for col, mask in enumerate(layout.column_masks) if changed & mask
+            ]
+
+            self.process_cells(changed)
+            self.process_lines(rows, columns)
+
+            if self.placeholders:
+                # a placeholder is resolved by looking along its row and
+                # column and, for single cell boats, at its neighbours
+                candidates = layout.spread(changed, "around")
+                for row in rows:
+                    candidates |= layout.row_masks[row]
+                for col in columns:
+                    candidates |= layout.column_masks[col]
+                self.replace_placeholders(candidates)
+
+        if self.is_valid and not self.is_feasible():
+            self.is_valid = False
+
+    def is_feasible(self) -> bool:
+        """Returns False if the board can be told to have no solution without
+        placing any more boats (forward checking):
+        - a hint or a count of boats went negative;
+        - a row or column needs more boat cells than it has empty cells;
+        - the boats left do not have as many cells as the hints still need,
+          plus the cells of the boats that are not complete yet;
+        - there are fewer slots for the boats of some size or larger than
+          boats of those sizes left. A line holds at most (n + 1) // (size
+          + 1) boats of that size or larger in each run of n cells that are
+          not water nor part of a complete boat, and at most as many as the
+          boat cells it still gets, divided by the size."""
+
+        layout = self.layout
+        empty = self.get_empty_cells()
+
+        if min(self.boats) < 0:
+            return False
+        lines = (
+            (layout.row_masks, self.row_hints, 1),
+            (layout.column_masks, self.column_hints, layout.stride),
+        )
+        for masks, hints, _ in lines:
+            for mask, hint in zip(masks, hints):
+                if hint < 0 or popcount(empty & mask) < hint:
+                    return False
+
+        unfinished = self.get_unfinished_cells()
+        fleet_cells = sum(size * count for size, count in enumerate(self.boats, 1))
+        missing = sum(self.row_hints)
+        if missing != sum(self.column_hints):
+            return False
+        if fleet_cells != missing + popcount(unfinished):
+            return False
+
+        # the largest size with boats left is checked first, as it is the
+        # one most likely to have run out of slots
+        largest = self.largest_boat()
+        if largest < 2:
+            return True
+
+        runs = []  # (lengths of the runs of a line, boat cells it still gets)
+        free = empty | unfinished
+        for masks, hints, step in lines:
+            for mask, hint in zip(masks, hints):
+                cells = free & mask
+                lengths = []
+                while cells:
+                    bit = cells & -cells
+                    length = 0
+                    while cells & bit:
+                        cells ^= bit
+                        bit <<= step
+                        length += 1
+                    if length > 1:
+                        lengths.append(length)
+                if lengths:
+                    runs.append((lengths, hint + popcount(unfinished & mask)))
+
+        needed = 0
+        for size in range(largest, 1, -1):
+            needed += self.boats[size - 1]
+            if not needed:
+                continue
+            slots = 0
+            for lengths, total in runs:
+                fits = sum((length + 1) // (size + 1) for length in lengths)
+                slots += min(fits, total // size)
+            if slots < needed:
+                return False
 
-            if empty_cells == self.empty_cells:
-                break
+        return True
 
     def __str__(self):
         """Returns a string representation of the Board as described in
@@ -695,8 +1031,9 @@ class Board:
 
         string = ""
 
-        for row in self.board:
-            for symbol in row:
+        for row in range(self.layout.rows):
+            for col in range(self.layout.columns):
+                symbol = self.get_value(row, col)
                 if symbol == "":
                     symbol = " "
                 elif symbol == "w":
@@ -707,36 +1044,60 @@ class Board:
         return string
 
     @staticmethod
-    def parse_instance() -> Board:
+    def parse_instance(
+        stream=None, fleet: Optional[List[int]] = None
+    ) -> Optional[Board]:
         """Lê o test do standard input (stdin) que é passado como argumento
-        e retorna uma instância da classe Board."""
+        e retorna uma instância da classe Board.
+
+        Another text or binary stream can be given instead of stdin, which
+        may hold several tests one after the other; each call reads the next
+        one and None is returned once the stream is exhausted. The size of
+        the board is given by the number of row and column hints. A test can
+        give its fleet in a FLEET line after the column hints, with the
+        number of boats of size 1, 2, 3..., as in "FLEET\t4\t3\t2\t1";
+        otherwise fleet is used, FLEET by default."""
+
+        if stream is None:
+            stream = sys.stdin
+
+        def readline() -> str:
+            line = stream.readline()
+            return line.decode() if isinstance(line, bytes) else line
 
-        row_hints = sys.stdin.readline().split("\t")[1:]  # ignore ROW keyword
+        line = readline()
+        while line and not line.strip():  # skip blank lines between tests
+            line = readline()
+
+        if not line:
+            return None
+
+        row_hints = line.split("\t")[1:]  # ignore ROW keyword
         row_hints = [int(x) for x in row_hints]
 
-        column_hints = sys.stdin.readline().split("\t")[1:]  # ignore COLUMN keyword
+        column_hints = readline().split("\t")[1:]  # ignore COLUMN keyword
         column_hints = [int(x) for x in column_hints]
 
-        hints_number = int(sys.stdin.readline())
+        line = readline()
+        if line.startswith("FLEET"):  # optional, for fleets other than FLEET
+            fleet = [int(x) for x in line.split("\t")[1:]]
+            line = readline()
 
-        board = [
-            ["" for _ in range(Board.ROWS_NUMBER)] for _ in range(Board.COLUMNS_NUMBER)
-        ]  # 10x10 empty board
+        hints_number = int(line)
 
-        boats = [4, 3, 2, 1]
-        empty_cells = Board.ROWS_NUMBER * Board.COLUMNS_NUMBER
-        board_instance = Board(row_hints, column_hints, board, boats, empty_cells)
+        boats = list(fleet or Board.FLEET)
+        board_instance = Board(row_hints, column_hints, boats)  # empty board
 
         L_T_pos = []
 
         for _ in range(hints_number):
-            hint = sys.stdin.readline().strip().split("\t")[1:]
+            hint = readline().strip().split("\t")[1:]
             row = int(hint[0])
             column = int(hint[1])
             letter = hint[2]
 
             if letter == "C":
-                board_instance.boats[0] -= 1
+                board_instance.count_boat(1)
 
             if letter in ("L", "T"):
                 L_T_pos.append((row, column, letter))
@@ -752,17 +1113,30 @@ class Board:
                     i += 1
 
                 if board_instance.get_value(row, col + i) == "R":
-                    board_instance.boats[i] -= 1
+                    board_instance.count_boat(i + 1)
 
             elif symbol[2] == "T":
                 while board_instance.get_value(row + i, col) == "M":
                     i += 1
 
                 if board_instance.get_value(row + i, col) == "B":
-                    board_instance.boats[i] -= 1
+                    board_instance.count_boat(i + 1)
 
         return board_instance
 
+    @staticmethod
+    def parse_instances(source, fleet: Optional[List[int]] = None) -> Iterator[Board]:
+        """Yields the boards of every test in the source, one at a time as
+        they are read: a text or binary stream, or a bytes buffer."""
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+
+        board = Board.parse_instance(source, fleet)
+        while board is not None:
+            yield board
+            board = Board.parse_instance(source, fleet)
+
 
 class Bimaru(Problem):
     def __init__(self, board: Board):
@@ -793,15 +1167,493 @@ class Bimaru(Problem):
 
         return state.board.is_goal()
 
+    def path_cost(self, c, state1: BimaruState, action, state2: BimaruState):
+        """Each boat completed costs one, whether it was placed by the action
+        or completed by the cleanup that follows, so every solution costs
+        the size of the fleet."""
+
+        return c + sum(state1.board.boats) - sum(state2.board.boats)
+
     def h(self, node: Node):
-        """Função heuristica utilizada para a procura A*."""
-        pass
+        """Função heuristica utilizada para a procura A*.
 
+        The boat cells still missing, from the hints of the rows and the
+        boat cells not part of a complete boat yet, divided by the largest
+        boat left and rounded up. Each boat still to place covers at most
+        that many of them, so this never exceeds the boats still to place,
+        the cost left to any solution, and f grows with the cells that the
+        placements and cleanups leave to the smaller boats."""
 
-if __name__ == "__main__":
-    board_instance = Board.parse_instance()
-    board_instance.cleanup()
-    node = depth_first_tree_search(Bimaru(board_instance))
+        board = node.state.board
+        largest = board.largest_boat()
+        if not largest:
+            return 0
+
+        unfinished = board.get_unfinished_cells()
+        return -(-(sum(board.row_hints) + popcount(unfinished)) // largest)
+
+    def h_segments(self, node: Node):
+        """Heuristic for greedy search: the boat segments still missing from
+        the rows plus the placeholders whose segment is still unknown."""
+
+        return node.state.missing
+
+
+def depth_first_trail_search(
+    board: Board,
+    table: Optional[TranspositionTable] = None,
+    limits: Optional[SearchLimits] = None,
+    ordering: Callable[[Board], List[Tuple[int, int, int, int, int]]] = (
+        Board.calculate_placeable_boats
+    ),
+) -> Optional[Board]:
+    """Depth first search over the boats placed on the board, exploring
+    actions in the same order as depth_first_tree_search does on Bimaru,
+    or in the one given by another ordering of the actions, such as
+    Board.calculate_constrained_boats. The last action is tried first.
 
-    if node:
-        print(node.state.board, end="")
+    Instead of copying the board for every child, boats are placed on the
+    given board itself and the trail keeps what each placement changed, so
+    that backtracking only has to restore the last entry. Returns the
+    board, now solved, or None if there is no solution.
+
+    Boards already explored through another order of the same boats are
+    skipped, as they have no solution either; the table remembers their
+    keys and a bounded one is used if none is given.
+
+    Each board examined counts as a node for the limits, if given; when
+    they are reached, None is returned and the board is left as it was at
+    that point of the search, which the limits also keep as their node."""
+
+    actions = partial(ordering, board)
+    apply_boat = board.apply_boat
+    is_goal = board.is_goal
+
+    if limits:
+        actions = limits.timed("actions", actions)
+        apply_boat = limits.timed("result", apply_boat)
+        is_goal = limits.timed("goal_test", is_goal)
+
+        if limits.reached(board):
+            return None
+
+    if is_goal():
+        return board
+
+    if table is None:
+        table = TranspositionTable()
+
+    trail = []  # the board before each boat of the current path was placed
+    pending = [reversed(actions())]
+
+    while pending:
+        action = next(pending[-1], None)
+
+        if action is None:
+            pending.pop()
+            if trail:
+                board.restore(trail.pop())
+            continue
+
+        if limits and limits.reached(board, len(pending)):
+            return None
+
+        row, col, size, direction, _ = action
+        trail.append(board.save())
+        apply_boat(row, col, size, direction)
+
+        if is_goal():
+            return board
+
+        if board.is_valid:
+            key = board.key()
+            if key in table:
+                board.restore(trail.pop())
+                continue
+            table.add(key)
+
+        pending.append(reversed(actions()))
+
+    return None
+
+
+def conflict_directed_search(
+    board: Board,
+    store: Optional[NogoodStore] = None,
+    limits: Optional[SearchLimits] = None,
+) -> Optional[Board]:
+    """Depth first search over the boats placed on the board, trying the
+    actions in the order of depth_first_trail_search, with conflict-directed
+    backjumping and nogood learning. Returns the board, now solved, or None
+    if there is no solution or the limits were reached.
+
+    Every dead end is explained by a nogood, a set of the boats placed on
+    the current path that no solution can hold all together. It starts as
+    the union of the nogoods of the actions explored from the board, minus
+    each action, and grows with the boats placed before, those near the
+    boats it does not explain yet first, until a board with only the
+    nogood placed is invalid, or every boat of the size the actions place
+    that it allows is explained: explored boats by their nogoods, and the
+    others by leaving that board invalid too.
+
+    When the nogood of an explored action does not hold it, the search
+    jumps back past every boat placed after the last one the nogood holds,
+    as neither their siblings nor they can fix it. The nogoods of exhausted
+    boards are kept in the store, a bounded one if none is given, and a
+    board holding every boat of one of them is not explored again, in
+    whatever order its boats were placed.
+
+    Each board examined counts as a node for the limits, if given; when
+    they are reached, None is returned and the board is left as it was at
+    that point of the search, which the limits also keep as their node."""
+
+    actions = board.calculate_placeable_boats
+    apply_boat = board.apply_boat
+    is_goal = board.is_goal
+
+    if limits:
+        actions = limits.timed("actions", actions)
+        apply_boat = limits.timed("result", apply_boat)
+        is_goal = limits.timed("goal_test", is_goal)
+
+        if limits.reached(board):
+            return None
+
+    if is_goal():
+        return board
+    if not board.is_valid:
+        return None
+
+    if store is None:
+        store = NogoodStore()
+
+    layout = board.layout
+    start = board.copy()
+    path = []  # the boats placed, in order
+    placed = set()  # the same boats, for the nogood lookups
+    areas = {}  # boat -> (its cells and halo, the rows and columns they span)
+
+    def area(boat):
+        if boat not in areas:
+            cells, halo = layout.get_boat(*boat)
+            around = cells | halo
+            lines = 0
+            for mask in layout.row_masks + layout.column_masks:
+                if mask & around:
+                    lines |= mask
+            areas[boat] = (around, lines)
+        return areas[boat]
+
+    def replay(boats, replayed=None):
+        """Places the given boats of the path, in the same order, on the
+        replayed board, or on a copy of the cleaned up board if None, and
+        returns it. Boats a previous one already completed are skipped."""
+
+        if replayed is None:
+            replayed = start.copy()
+        for boat in path:
+            if boat in boats:
+                cells, _ = layout.get_boat(*boat)
+                if cells & ~replayed.get_complete_boats():
+                    replayed.apply_boat(*boat)
+                if not replayed.is_valid:
+                    break
+        return replayed
+
+    def explain(nogood, size, failed, tried):
+        # the boats are placed on the same replayed board in whatever order
+        # they are added to the nogood, which is sound
+        nogood = set(nogood)
+        replayed = replay(nogood)
+        explained = set()
+        while replayed.is_valid and len(nogood) < len(path):
+            complete = replayed.get_complete_boats()
+            unexplained = 0  # cells of the boats left to explain
+            for row, col, _, direction, _ in replayed.calculate_placeable_boats(size):
+                boat = (row, col, size, direction)
+                cells, _ = layout.get_boat(*boat)
+                if cells & complete or boat in explained:
+                    continue
+                if boat in failed:
+                    trial = replayed.copy()
+                    trial.apply_boat(*boat)
+                    if not trial.is_valid:
+                        explained.add(boat)
+                        continue
+                elif boat in tried:
+                    continue
+                unexplained |= cells
+            if not unexplained:
+                break
+
+            # boats that touch the unexplained ones, else that share a line
+            # with them, else all the rest
+            rest = [boat for boat in path if boat not in nogood]
+            culprits = [boat for boat in rest if area(boat)[0] & unexplained]
+            if not culprits:
+                culprits = [boat for boat in rest if area(boat)[1] & unexplained]
+            culprits = culprits or rest
+            nogood.update(culprits)
+            replay(culprits, replayed)
+
+        return frozenset(nogood)
+
+    def explore() -> Optional[frozenset]:
+        """Explores the board as it is, returning None if it was solved or
+        the limits were reached, and its nogood otherwise."""
+
+        size = board.largest_boat()
+        if size == 0:
+            return frozenset(path)
+
+        nogood = set()  # union of the nogoods of the explored boats
+        failed = set()  # boats that left the board invalid
+        tried = set()
+        for row, col, _, direction, _ in reversed(actions()):
+            if limits and limits.reached(board, len(path)):
+                return None
+
+            boat = (row, col, size, direction)
+            saved = board.save()
+            path.append(boat)
+            placed.add(boat)
+            apply_boat(*boat)
+
+            if is_goal():
+                return None
+
+            found = None
+            if board.is_valid:
+                found = store.find(placed, boat)
+                if found is None:
+                    found = explore()
+                    if found is None:
+                        return None
+
+            path.pop()
+            placed.discard(boat)
+            board.restore(saved)
+            tried.add(boat)
+
+            if found is None:
+                failed.add(boat)
+            elif boat not in found:
+                return found  # backjump
+            else:
+                nogood |= found
+                nogood.discard(boat)
+
+        nogood = explain(nogood, size, failed, tried)
+        store.add(nogood)
+        return nogood
+
+    explore()
+    return board if board.is_goal() else None
+
+
+def exact_cover_search(
+    board: Board, limits: Optional[SearchLimits] = None
+) -> Optional[Board]:
+    """Solves a cleaned up board as an exact cover problem with the
+    Algorithm X of dlx.py. Returns the board, now solved, or None if there
+    is no solution or the limits were reached.
+
+    The options are the actions of calculate_placeable_boats for every size
+    still to place, minus those over a complete boat. Each covers:
+    - the boats left of its size, needed as many times as there are;
+    - the row and column hints, as many times as empty cells it fills in
+      each, so a line never gets more boat cells than its hint;
+    - the boat cells that are not part of a complete boat yet;
+    - and, as secondary items, its own cells, which no other option may
+      take, and the cells around it, which only other boats' halos may.
+
+    When the limits are reached, they keep as their node a copy of the
+    board with the boats chosen until then placed on it."""
+
+    if not board.is_valid:
+        return None
+
+    layout = board.layout
+    problem = ExactCover()
+    empty = board.get_empty_cells()
+    complete = board.get_complete_boats()
+    unfinished = board.get_unfinished_cells()
+
+    for size, count in enumerate(board.boats, 1):
+        problem.add_item(("boats", size), count)
+    for row, hint in enumerate(board.row_hints):
+        problem.add_item(("row", row), hint)
+    for col, hint in enumerate(board.column_hints):
+        problem.add_item(("column", col), hint)
+    mask = unfinished
+    while mask:
+        bit = mask & -mask
+        problem.add_item(bit)
+        mask ^= bit
+
+    for size in range(len(board.boats), 0, -1):
+        for row, col, _, direction, _ in board.calculate_placeable_boats(size):
+            cells, halo = layout.get_boat(row, col, size, direction)
+            if cells & complete:
+                continue
+
+            primary = {("boats", size): 1}
+            secondary = {}
+            mask = cells
+            while mask:
+                bit = mask & -mask
+                if bit & empty:
+                    line_row, line_col = layout.position(bit)
+                    for line in (("row", line_row), ("column", line_col)):
+                        primary[line] = primary.get(line, 0) + 1
+                elif bit & unfinished:
+                    primary[bit] = 1
+                secondary[bit] = None
+                mask ^= bit
+            mask = halo
+            while mask:
+                bit = mask & -mask
+                secondary[bit] = "w"
+                mask ^= bit
+
+            problem.add_option((row, col, size, direction), primary, secondary)
+
+    solution = problem.solve(limits)
+    if solution is None:
+        if limits and limits.reason:
+            reached = board.copy()
+            for boat in limits.node or ():
+                cells, _ = layout.get_boat(*boat)
+                if cells & ~reached.get_boat_cells():
+                    reached.apply_boat(*boat)
+            limits.node = reached
+        return None
+
+    for row, col, size, direction in solution:
+        cells, _ = layout.get_boat(row, col, size, direction)
+        if cells & ~board.get_boat_cells():  # else completed by the cleanup
+            board.apply_boat(row, col, size, direction)
+
+    return board if board.is_goal() else None
+
+
+def best_first(search):
+    """Adapts one of the Problem searches of search.py to take a cleaned up
+    board and return the solved board. The limits, if given, keep the board
+    of the last node examined as their node."""
+
+    def solve_board(
+        board: Board, limits: Optional[SearchLimits] = None
+    ) -> Optional[Board]:
+        problem = Bimaru(board)
+        if limits:
+            problem = limits.problem(problem)
+        node = search(problem, limits=limits)
+        if limits and isinstance(limits.node, Node):
+            limits.node = limits.node.state.board
+        return node.state.board if node else None
+
+    return solve_board
+
+
+SEARCHES = {
+    "dfs": depth_first_trail_search,
+    # depth first search with the orderings of calculate_constrained_boats
+    "forced": partial(
+        depth_first_trail_search, ordering=Board.calculate_constrained_boats
+    ),
+    "mrv-fewest": partial(
+        depth_first_trail_search,
+        ordering=partial(Board.calculate_constrained_boats, variables="fewest"),
+    ),
+    "mrv-eliminated": partial(
+        depth_first_trail_search,
+        ordering=partial(
+            Board.calculate_constrained_boats,
+            variables="fewest",
+            values="eliminated",
+        ),
+    ),
+    "cbj": conflict_directed_search,
+    "dlx": exact_cover_search,
+    "greedy": best_first(
+        lambda problem, limits: greedy_search(problem, problem.h_segments, limits)
+    ),
+    "astar": best_first(astar_search),
+    "rbfs": best_first(
+        # ties between equal f are broken by BimaruState, as in the
+        # priority queues of greedy and astar
+        partial(recursive_best_first_search, key=lambda node: (node.f, node))
+    ),
+}
+
+
+def solve(
+    board: Board, search: str = "dfs", limits: Optional[SearchLimits] = None
+) -> Optional[Board]:
+    """Solves a board returned by parse_instance with one of the SEARCHES,
+    in place for dfs. Returns the solved board, or None if it has no
+    solution or the search was stopped by its limits."""
+
+    board.cleanup()
+    return SEARCHES[search](board, limits=limits)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Solves a Bimaru test read from stdin."
+    )
+    parser.add_argument(
+        "--search",
+        choices=SEARCHES,
+        default="dfs",
+        help="search algorithm to use; greedy favours the boards missing the "
+        "fewest boat cells and placeholders, astar and rbfs the lowest boats "
+        "completed plus a lower bound on the boats left; forced branches on "
+        "the boat cells only one boat can finish first, mrv-fewest on whatever "
+        "has the fewest boats, and mrv-eliminated also tries first the boats "
+        "that rule out the fewest others (default: dfs)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="give up on the search after this many seconds",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="print statistics of the search to stderr as JSON",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="with --metrics, also trace the peak memory the search allocates "
+        "(much slower)",
+    )
+    parser.add_argument(
+        "--fleet",
+        type=int,
+        nargs="+",
+        metavar="COUNT",
+        help="number of boats of size 1, 2, 3... for a test that does not "
+        "give its own fleet (default: 4 3 2 1)",
+    )
+    args = parser.parse_args()
+
+    board_instance = Board.parse_instance(fleet=args.fleet)
+    if args.metrics:
+        limits = SearchMetrics(max_time=args.timeout, trace_memory=args.trace_memory)
+    elif args.timeout:
+        limits = SearchLimits(max_time=args.timeout)
+    else:
+        limits = None
+    solution = solve(board_instance, args.search, limits)
+
+    if solution:
+        print(solution, end="")
+
+    if args.metrics:
+        print(limits.to_json(), file=sys.stderr)
@@ -0,0 +1,176 @@
+# dlx.py: Knuth's Algorithm X for exact cover problems, extended with the
+# multiplicities and colours Bimaru needs to be written as one.
+#
+# An exact cover problem has items, which must be covered, and options, each
+# covering some of them; a solution is a set of options covering every item
+# exactly once. Here each primary item has to be covered a given number of
+# times, counted with the weight each option gives it, and secondary items
+# only have to be covered at most once, or by any number of options giving
+# them the same colour.
+#
+# As in Knuth's dancing links, covering an option hides every option that
+# can no longer be taken with it and uncovering restores them in reverse
+# order; the links are Python sets kept per item.
+
+from typing import Dict, Hashable, List, Optional
+
+from search import SearchLimits
+
+
+class ExactCover:
+    """An exact cover problem with multiplicities and colours, solved with
+    Algorithm X, always branching on the most constrained primary item: the
+    one with fewest options left beyond the number of times it is needed.
+
+    Options are tried in the order they were added. Once an option has been
+    tried, the branches after it leave it out, so every solution is found
+    at most once, however many times its items are needed."""
+
+    def __init__(self):
+        self.options = {}  # option -> (primary weights, secondary colours)
+        self.items = {}  # item -> the options still available that cover it
+        self.need = {}  # primary item -> how many more times it must be covered
+        self.supply = {}  # primary item -> sum of the weights of its options
+        self.order = {}  # option -> the position it was added in
+        self.removed = []  # stack of the options hidden so far
+
+    def add_item(self, item: Hashable, need: int = 1):
+        """Adds a primary item that must be covered need times."""
+
+        self.items[item] = set()
+        self.need[item] = need
+        self.supply[item] = 0
+
+    def add_option(
+        self,
+        option: Hashable,
+        primary: Dict[Hashable, int],
+        secondary: Dict[Hashable, Optional[Hashable]],
+    ) -> bool:
+        """Adds an option covering each primary item the given number of
+        times and each secondary item with the given colour, None if no
+        other option may cover it. Secondary items are added as needed.
+
+        Options that would cover a primary item more times than it needs are
+        left out, and False is returned."""
+
+        if any(weight > self.need[item] for item, weight in primary.items()):
+            return False
+
+        self.options[option] = (primary, secondary)
+        self.order[option] = len(self.order)
+        for item, weight in primary.items():
+            self.items[item].add(option)
+            self.supply[item] += weight
+        for item in secondary:
+            self.items.setdefault(item, set()).add(option)
+        return True
+
+    def hide(self, option: Hashable):
+        primary, secondary = self.options[option]
+        for item, weight in primary.items():
+            self.items[item].discard(option)
+            self.supply[item] -= weight
+        for item in secondary:
+            self.items[item].discard(option)
+        self.removed.append(option)
+
+    def unhide(self, mark: int):
+        """Restores the options hidden since the removed stack had mark
+        options."""
+
+        removed = self.removed
+        while len(removed) > mark:
+            option = removed.pop()
+            primary, secondary = self.options[option]
+            for item, weight in primary.items():
+                self.items[item].add(option)
+                self.supply[item] += weight
+            for item in secondary:
+                self.items[item].add(option)
+
+    def cover(self, option: Hashable):
+        """Takes the option, hiding it and every option that conflicts with
+        it: those needing more of an item than is left, and those covering
+        one of its secondary items with another colour."""
+
+        primary, secondary = self.options[option]
+        options = self.options
+        self.hide(option)
+
+        for item, weight in primary.items():
+            need = self.need[item] - weight
+            self.need[item] = need
+            for other in list(self.items[item]):
+                if options[other][0][item] > need:
+                    self.hide(other)
+
+        for item, colour in secondary.items():
+            for other in list(self.items[item]):
+                if colour is None or options[other][1][item] != colour:
+                    self.hide(other)
+
+    def uncover(self, option: Hashable, mark: int):
+        for item, weight in self.options[option][0].items():
+            self.need[item] += weight
+        self.unhide(mark)
+
+    def choose(self) -> Optional[Hashable]:
+        """Returns the primary item still needed with fewest options to spare,
+        False if one of them can no longer be covered, or None if none is
+        needed."""
+
+        best = None
+        fewest = None  # options left beyond those the item needs
+        for item, need in self.need.items():
+            if not need:
+                continue
+            if self.supply[item] < need:
+                return False
+            count = len(self.items[item]) - need
+            if fewest is None or count < fewest:
+                best, fewest = item, count
+        return best
+
+    def solve(self, limits: Optional[SearchLimits] = None) -> Optional[List[Hashable]]:
+        """Returns the options of a solution, or None if there is none or the
+        search was stopped by its limits. Each option covered counts as a
+        node, and choosing the item to branch on as expanding it; the limits
+        keep the options chosen until they were reached as their node."""
+
+        choose = self.choose
+        if limits:
+            choose = limits.timed("actions", choose)
+
+        solution = []
+        if self.search(solution, choose, limits):
+            return solution
+        return None
+
+    def search(self, solution: List[Hashable], choose, limits) -> bool:
+        item = choose()
+        if item is None:
+            return True
+        if item is False:
+            return False
+
+        mark = len(self.removed)
+        for option in sorted(self.items[item], key=self.order.__getitem__):
+            if limits and limits.reached(tuple(solution), len(solution)):
+                break
+
+            inner = len(self.removed)
+            self.cover(option)
+            solution.append(option)
+            if self.search(solution, choose, limits):
+                return True
+            solution.pop()
+            self.uncover(option, inner)
+
+            # the next branches do without this option
+            self.hide(option)
+            if self.supply[item] < self.need[item]:
+                break
+
+        self.unhide(mark)
+        return False
@@ -0,0 +1,146 @@
+# portfolio.py: Solves a single Bimaru test by splitting the search tree among
+# worker processes, so that one unlucky branch order does not decide how long
+# a hard test takes.
+#
+# Usage: python3 portfolio.py [-j JOBS] [--split N] < test.txt
+
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+from typing import List, Optional, Tuple
+
+from bimaru import Board, depth_first_trail_search
+
+Action = Tuple[int, int, int, int, int]
+
+
+def split(board: Board, count: int) -> Tuple[Optional[Board], List[List[Action]]]:
+    """Expands the search tree of a cleaned up board one level at a time
+    until it has at least count open nodes, each given by the actions that
+    lead to it from the board, in the order depth first search visits them.
+
+    Returns a solved board instead if one is found on the way. An empty list
+    means there is no solution."""
+
+    if board.is_goal():
+        return board, []
+
+    paths = [[]]
+
+    while paths and len(paths) < count:
+        children = []
+
+        for path in paths:
+            saved = board.save()
+            apply_path(board, path)
+
+            for action in reversed(board.calculate_placeable_boats()):
+                child_saved = board.save()
+                board.apply_boat(*action[:4])
+
+                if board.is_goal():
+                    return board, []
+
+                if board.calculate_placeable_boats():
+                    children.append(path + [action])
+
+                board.restore(child_saved)
+
+            board.restore(saved)
+
+        if len(children) <= len(paths):  # the tree is not getting any wider
+            return None, children
+
+        paths = children
+
+    return None, paths
+
+
+def apply_path(board: Board, path: List[Action]):
+    """Places the boats of the given actions on the board."""
+
+    for row, col, size, direction, _ in path:
+        board.apply_boat(row, col, size, direction)
+
+
+def solve_subproblem(task: Tuple[Board, List[Action]]) -> Optional[Board]:
+    """Searches the subtree below the given path of the board."""
+
+    board, path = task
+    apply_path(board, path)
+
+    return depth_first_trail_search(board)
+
+
+def portfolio_search(
+    board: Board, jobs: Optional[int] = None, count: Optional[int] = None
+) -> Optional[Board]:
+    """Solves a board returned by parse_instance with jobs worker processes,
+    one per core by default. The tree is split into at least count subtrees,
+    four per worker by default, which the workers take in depth first order.
+    All workers are stopped as soon as one of them finds a solution.
+
+    Returns the solved board, or None if it has no solution."""
+
+    jobs = jobs or os.cpu_count() or 1
+    count = count or 4 * jobs
+
+    board.cleanup()
+    solution, paths = split(board, count)
+
+    if solution or not paths:
+        return solution
+
+    if jobs == 1:
+        for path in paths:
+            saved = board.save()
+            solution = solve_subproblem((board, path))
+            if solution:
+                return solution
+            board.restore(saved)
+        return None
+
+    pool = Pool(jobs)
+    try:
+        tasks = [(board, path) for path in paths]
+        for solution in pool.imap_unordered(solve_subproblem, tasks):
+            if solution:
+                return solution
+        return None
+    finally:
+        pool.terminate()  # stops the workers still searching other subtrees
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Solves a Bimaru test read from stdin in parallel."
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of worker processes (default: one per core)",
+    )
+    parser.add_argument(
+        "--split",
+        type=int,
+        metavar="N",
+        help="minimum number of subtrees to split the search into "
+        "(default: four per worker)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+
+    solution = portfolio_search(Board.parse_instance(), args.jobs, args.split)
+
+    if solution:
+        print(solution, end="")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,546 @@
+# sat.py: Solves Bimaru tests by compiling the board into boolean constraints
+# and handing them to a small conflict driven clause learning SAT solver,
+# written in pure Python so that it needs nothing but the interpreter.
+#
+# Usage: python3 sat.py < test.txt
+#
+# Every cell has a variable that is true when it holds a boat segment, and
+# every position a boat of the fleet can take has a variable that is true
+# when the boat is there. A boat fills its cells and leaves the cells around
+# it empty, every boat cell is covered by some boat, and the boat cells of
+# each line and the boats of each size are counted with sequential counters.
+
+from heapq import heappop, heappush
+from typing import List, Optional, Sequence, Tuple
+
+from bimaru import Board
+from search import SearchLimits
+from utils import popcount
+
+
+class CDCLSolver:
+    """A conflict driven clause learning SAT solver.
+
+    Variables are numbered from 1 and literals are given as in DIMACS, v for
+    the variable v being true and -v for it being false. Internally v is the
+    literal 2 * v and -v is 2 * v + 1, so that lit ^ 1 negates a literal.
+
+    Each clause is watched by its first two literals. Conflicts are learned
+    as first unique implication point clauses, decisions take the unassigned
+    variable with the highest activity (VSIDS) with the value it last had,
+    and the search restarts after a Luby sequence of conflicts."""
+
+    RESTART_UNIT = 64  # conflicts per unit of the Luby sequence
+    DECAY = 0.95
+
+    def __init__(self):
+        self.num_vars = 0
+        self.values = [0, 0]  # per literal: 1 true, -1 false, 0 unassigned
+        self.level = [0]
+        self.reason = [None]
+        self.activity = [0.0]
+        self.phase = [1]  # per variable, 1 if it was last false
+        self.seen = [False]
+        self.decision = [False]
+        self.watches = [[], []]  # per literal, the clauses watching it
+        self.trail = []
+        self.trail_limits = []  # where each decision level starts in trail
+        self.head = 0  # next literal of the trail to propagate
+        self.heap = []
+        self.increment = 1.0
+        self.unsatisfiable = False
+        self.model = None
+        self.conflicts = 0
+        self.decisions = 0
+
+    def new_var(self, decision: bool = True) -> int:
+        """Returns a new variable. Only decision variables are branched on;
+        the others are expected to be implied by them."""
+
+        self.num_vars += 1
+        var = self.num_vars
+        self.values += [0, 0]
+        self.level.append(0)
+        self.reason.append(None)
+        self.activity.append(0.0)
+        self.phase.append(1)
+        self.seen.append(False)
+        self.decision.append(decision)
+        self.watches += [[], []]
+        if decision:
+            heappush(self.heap, (0.0, var))
+        return var
+
+    def add_clause(self, literals: Sequence[int]):
+        """Adds the clause made of the given DIMACS literals. Clauses can only
+        be added before solving or between calls to solve."""
+
+        clause = []
+        for literal in literals:
+            lit = 2 * literal if literal > 0 else -2 * literal + 1
+            if self.values[lit] == 1 or lit ^ 1 in clause:
+                return  # already satisfied, or always true
+            if self.values[lit] == 0 and lit not in clause:
+                clause.append(lit)
+
+        if not clause:
+            self.unsatisfiable = True
+        elif len(clause) == 1:
+            self.assign(clause[0], None)
+        else:
+            self.watches[clause[0]].append(clause)
+            self.watches[clause[1]].append(clause)
+
+    def assign(self, lit: int, reason: Optional[List[int]]):
+        var = lit >> 1
+        self.values[lit] = 1
+        self.values[lit ^ 1] = -1
+        self.level[var] = len(self.trail_limits)
+        self.reason[var] = reason
+        self.trail.append(lit)
+
+    def propagate(self) -> Optional[List[int]]:
+        """Assigns every literal implied by the trail, returning the clause
+        all of whose literals became false, if any."""
+
+        values = self.values
+        watches = self.watches
+        trail = self.trail
+
+        while self.head < len(trail):
+            false_lit = trail[self.head] ^ 1
+            self.head += 1
+
+            watchers = watches[false_lit]
+            watches[false_lit] = kept = []
+
+            for index, clause in enumerate(watchers):
+                # keep the false literal second, so the first one is the
+                # other watched literal
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], false_lit
+                first = clause[0]
+                if values[first] == 1:
+                    kept.append(clause)
+                    continue
+
+                for k in range(2, len(clause)):
+                    other = clause[k]
+                    if values[other] != -1:
+                        clause[1], clause[k] = other, false_lit
+                        watches[other].append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if values[first] == -1:
+                        kept.extend(watchers[index + 1 :])
+                        return clause
+                    self.assign(first, clause)
+
+        return None
+
+    def analyze(self, conflict: List[int]) -> Tuple[List[int], int]:
+        """Returns the clause learned from the conflict, with the literal it
+        asserts first, and the level to backjump to."""
+
+        level = self.level
+        reason = self.reason
+        seen = self.seen
+        trail = self.trail
+        current = len(self.trail_limits)
+
+        learnt = [0]
+        pending = 0  # literals of the current level still to resolve
+        index = len(trail) - 1
+        clause = conflict
+        start = 0
+
+        while True:
+            for lit in clause[start:]:
+                var = lit >> 1
+                if not seen[var] and level[var] > 0:
+                    seen[var] = True
+                    self.bump(var)
+                    if level[var] == current:
+                        pending += 1
+                    else:
+                        learnt.append(lit)
+
+            while not seen[trail[index] >> 1]:
+                index -= 1
+            lit = trail[index]
+            index -= 1
+            var = lit >> 1
+            seen[var] = False
+            pending -= 1
+            if not pending:
+                break
+            clause = reason[var]
+            start = 1  # the first literal of a reason is the one it implied
+
+        learnt[0] = lit ^ 1
+
+        # drop the literals implied by the others
+        minimized = [learnt[0]]
+        for lit in learnt[1:]:
+            clause = reason[lit >> 1]
+            if clause is None or not all(
+                seen[other >> 1] or level[other >> 1] == 0 for other in clause[1:]
+            ):
+                minimized.append(lit)
+        for lit in learnt[1:]:
+            seen[lit >> 1] = False
+
+        back = 0
+        if len(minimized) > 1:
+            highest = max(
+                range(1, len(minimized)), key=lambda i: level[minimized[i] >> 1]
+            )
+            minimized[1], minimized[highest] = minimized[highest], minimized[1]
+            back = level[minimized[1] >> 1]
+
+        return minimized, back
+
+    def bump(self, var: int):
+        activity = self.activity
+        activity[var] += self.increment
+        if activity[var] > 1e100:
+            for other in range(1, self.num_vars + 1):
+                activity[other] *= 1e-100
+            self.increment *= 1e-100
+            self.rebuild_heap()
+        elif self.decision[var] and not self.values[2 * var]:
+            heappush(self.heap, (-activity[var], var))
+
+    def rebuild_heap(self):
+        """Rebuilds the heap from the unassigned decision variables, dropping
+        the entries left behind by bumps and backtracking."""
+
+        self.heap = [
+            (-self.activity[var], var)
+            for var in range(1, self.num_vars + 1)
+            if self.decision[var] and not self.values[2 * var]
+        ]
+        self.heap.sort()
+
+    def backtrack(self, level: int):
+        """Undoes every assignment made above the given decision level."""
+
+        if len(self.trail_limits) <= level:
+            return
+
+        values = self.values
+        limit = self.trail_limits[level]
+        for lit in self.trail[limit:]:
+            var = lit >> 1
+            values[lit] = values[lit ^ 1] = 0
+            self.reason[var] = None
+            self.phase[var] = lit & 1
+            if self.decision[var]:
+                heappush(self.heap, (-self.activity[var], var))
+
+        del self.trail[limit:]
+        del self.trail_limits[level:]
+        self.head = limit
+
+        if len(self.heap) > 4 * self.num_vars:
+            self.rebuild_heap()
+
+    def decide(self) -> Optional[int]:
+        """Returns the literal to assign next, or None if every variable is
+        assigned."""
+
+        heap = self.heap
+        values = self.values
+        while heap:
+            var = heappop(heap)[1]
+            if not values[2 * var]:
+                return 2 * var + self.phase[var]
+        for var in range(1, self.num_vars + 1):  # left unimplied
+            if not values[2 * var]:
+                return 2 * var + self.phase[var]
+        return None
+
+    def solve(self, limits: Optional[SearchLimits] = None) -> Optional[bool]:
+        """Returns True if the clauses are satisfiable, leaving the value of
+        each variable in model, False if they are not, or None if the search
+        was stopped by its limits, leaving in model the values the variables
+        had then, unassigned ones as false.
+
+        Each decision counts as a node for the limits, which time choosing
+        it as the 'actions' of the search and propagating its consequences
+        as the 'result'."""
+
+        propagate = self.propagate
+        decide = self.decide
+        if limits:
+            propagate = limits.timed("result", propagate)
+            decide = limits.timed("actions", decide)
+
+        self.model = None
+        if self.unsatisfiable or propagate() is not None:
+            self.unsatisfiable = True
+            return False
+
+        restarts = 0
+        budget = luby(restarts) * CDCLSolver.RESTART_UNIT
+
+        while True:
+            conflict = propagate()
+
+            if conflict is not None:
+                self.conflicts += 1
+                budget -= 1
+                if not self.trail_limits:
+                    self.unsatisfiable = True
+                    return False
+
+                learnt, back = self.analyze(conflict)
+                self.backtrack(back)
+                if len(learnt) == 1:
+                    self.assign(learnt[0], None)
+                else:
+                    self.watches[learnt[0]].append(learnt)
+                    self.watches[learnt[1]].append(learnt)
+                    self.assign(learnt[0], learnt)
+                self.increment /= CDCLSolver.DECAY
+                continue
+
+            if budget <= 0:
+                self.backtrack(0)
+                restarts += 1
+                budget = luby(restarts) * CDCLSolver.RESTART_UNIT
+                continue
+
+            lit = decide()
+            if lit is None:
+                self.model = [False] + [
+                    self.values[2 * var] == 1 for var in range(1, self.num_vars + 1)
+                ]
+                self.backtrack(0)
+                return True
+
+            if limits and limits.reached():
+                self.model = [False] + [
+                    self.values[2 * var] == 1 for var in range(1, self.num_vars + 1)
+                ]
+                self.backtrack(0)
+                return None
+
+            self.decisions += 1
+            self.trail_limits.append(len(self.trail))
+            self.assign(lit, None)
+
+
+def luby(index: int) -> int:
+    """Returns the index-th term, from 0, of the Luby sequence 1, 1, 2, 1, 1,
+    2, 4, 1, 1, 2, 1, 1, 2, 4, 8..."""
+
+    size, exponent = 1, 0
+    while size < index + 1:
+        exponent += 1
+        size = 2 * size + 1
+    while size - 1 != index:
+        size = (size - 1) // 2
+        exponent -= 1
+        index %= size
+    return 1 << exponent
+
+
+def add_exactly(solver: CDCLSolver, literals: List[int], count: int):
+    """Adds the clauses that make exactly count of the literals true, with a
+    sequential counter: after the i-th literal, its j-th register is true
+    when at least j + 1 of the first i literals are."""
+
+    if count < 0 or count > len(literals):
+        solver.add_clause([])
+        return
+    if count == 0 or count == len(literals):
+        for literal in literals:
+            solver.add_clause([literal if count else -literal])
+        return
+
+    previous = []
+    for i, literal in enumerate(literals):
+        registers = [
+            solver.new_var(decision=False) for _ in range(min(i + 1, count + 1))
+        ]
+        for j, register in enumerate(registers):
+            # at least j + 1 so far if there were already, or if there were
+            # j before and this literal is true
+            below = [previous[j]] if j < len(previous) else []
+            for other in below:
+                solver.add_clause([-other, register])
+            solver.add_clause([-register, literal] + below)
+            if j == 0:
+                solver.add_clause([-literal, register])
+            else:
+                carry = previous[j - 1]
+                solver.add_clause([-literal, -carry, register])
+                solver.add_clause([-register, carry] + below)
+        previous = registers
+
+    solver.add_clause([previous[count - 1]])
+    if len(previous) > count:
+        solver.add_clause([-previous[count]])
+
+
+def bits(mask: int):
+    """Yields every cell of the mask."""
+
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+
+def boat_segments(
+    size: int, direction: int, cells: int, first: int, inner: int, last: int
+):
+    """Returns the cells of a boat holding each segment, in the order of
+    Board.SEGMENTS."""
+
+    if size == 1:
+        return (cells, 0, 0, 0, 0, 0)
+    if direction == Board.HORIZONTAL_DIRECTION:
+        return (0, 0, 0, first, last, inner)
+    return (0, first, last, 0, 0, inner)
+
+
+# the variable of a boat, its segments and its (row, col, size, direction)
+Boat = Tuple[int, Tuple[int, int, int, int, int, int], Tuple[int, int, int, int]]
+
+
+def encode(board: Board) -> Tuple[CDCLSolver, List[Boat]]:
+    """Compiles the board into clauses, returning the solver holding them and
+    the variable and segments of every boat that can be placed.
+
+    The cells the board already knows are fixed, so a board that was cleaned
+    up compiles into fewer boats. The whole fleet is encoded, including the
+    boats already on the board, which can only be covered by themselves.
+    Only the boats are decision variables, the cells and counters follow."""
+
+    layout = board.layout
+    solver = CDCLSolver()
+    boat_cells = board.placeholders | board.get_boat_cells()
+
+    cells = {}
+    covering = {}
+    for bit in bits(layout.cells):
+        cells[bit] = solver.new_var(decision=False)
+        covering[bit] = []
+        if board.water & bit:
+            solver.add_clause([-cells[bit]])
+        elif boat_cells & bit:
+            solver.add_clause([cells[bit]])
+
+    line_totals = (
+        [
+            hint + popcount(boat_cells & mask)
+            for hint, mask in zip(board.row_hints, layout.row_masks)
+        ],
+        [
+            hint + popcount(boat_cells & mask)
+            for hint, mask in zip(board.column_hints, layout.column_masks)
+        ],
+    )
+
+    # counting is hard for resolution, so a fleet that does not add up to
+    # the hints is ruled out before encoding anything else
+    fleet_cells = sum(size * count for size, count in enumerate(board.fleet, 1))
+    if not sum(line_totals[0]) == sum(line_totals[1]) == fleet_cells:
+        solver.add_clause([])
+
+    # the largest boats first, which the solver breaks its ties in favour of
+    boats = []
+    for size, count in reversed(list(enumerate(board.fleet, 1))):
+        fleet = []
+        for row, col, direction, mask, first, inner, last, halo in (
+            layout.get_placements(size) if count else ()
+        ):
+            if mask & board.water or halo & boat_cells:
+                continue
+            if line_totals[direction][col if direction else row] < size:
+                continue
+            segments = boat_segments(size, direction, mask, first, inner, last)
+            if any(
+                known & mask & ~expected
+                for known, expected in zip(board.segments, segments)
+            ):
+                continue
+
+            var = solver.new_var()
+            for bit in bits(mask):
+                solver.add_clause([-var, cells[bit]])
+                covering[bit].append(var)
+            for bit in bits(halo):
+                solver.add_clause([-var, -cells[bit]])
+            fleet.append(var)
+            boats.append((var, segments, (row, col, size, direction)))
+
+        add_exactly(solver, fleet, count)
+
+    for bit, var in cells.items():
+        solver.add_clause([-var] + covering[bit])
+
+    for lines, totals in zip((layout.row_masks, layout.column_masks), line_totals):
+        for mask, total in zip(lines, totals):
+            add_exactly(solver, [cells[bit] for bit in bits(mask)], total)
+
+    return solver, boats
+
+
+def decode(board: Board, solver: CDCLSolver, boats: List[Boat]) -> Board:
+    """Returns a copy of the board with the boats of the solver's model
+    placed on it and water everywhere else."""
+
+    solution = board.copy()
+    for var, segments, _ in boats:
+        if solver.model[var]:
+            for symbol, mask in zip(Board.SEGMENTS, segments):
+                if mask:
+                    solution.place_segment(symbol, mask)
+
+    solution.fill(solution.get_empty_cells(), 0)
+    solution.boats = [0] * len(solution.boats)
+    solution.changed = 0
+    return solution
+
+
+def decode_reached(board: Board, solver: CDCLSolver, boats: List[Boat]) -> Board:
+    """Returns a copy of the board with the boats the solver had placed when
+    its limits stopped it, each followed by its cleanup."""
+
+    reached = board.copy()
+    for var, _, placement in boats:
+        if solver.model[var]:
+            cells, _ = reached.layout.get_boat(*placement)
+            if cells & ~reached.get_boat_cells():  # else already on the board
+                reached.apply_boat(*placement)
+    return reached
+
+
+def solve_board(board: Board, limits: Optional[SearchLimits] = None) -> Optional[Board]:
+    """Solves a board returned by parse_instance, cleaned up or not, as SAT.
+    Returns the solved board, or None if it has no solution or the solver
+    was stopped by its limits, which then keep the board it had reached as
+    their node."""
+
+    if not board.is_valid:
+        return None
+
+    solver, boats = encode(board)
+    solved = solver.solve(limits)
+    if solved is None and limits and limits.reason:
+        limits.node = decode_reached(board, solver, boats)
+    if not solved:
+        return None
+
+    return decode(board, solver, boats)
+
+
+if __name__ == "__main__":
+    solution = solve_board(Board.parse_instance())
+
+    if solution:
+        print(solution, end="")
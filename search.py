@@ -6,7 +6,9 @@ then create problem instances and solve them with calls to the various search
 functions.
 """
 
+import json
 import sys
+import time
 from collections import deque
 
 from utils import *
@@ -75,6 +77,9 @@ class Node:
     an explanation of how the f and h values are handled. You will not need to
     subclass this class."""
 
+    # f and h are set by the searches that memoize them on the node
+    __slots__ = ("state", "parent", "action", "path_cost", "depth", "f", "h")
+
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
         self.state = state
@@ -96,6 +101,15 @@ class Node:
         return [self.child_node(problem, action)
                 for action in problem.actions(self.state)]
 
+    def expand_lazily(self, problem, reverse=False):
+        """Yield the nodes reachable in one step from this node, building
+        each one only when it is asked for. With reverse=True the actions
+        are taken last to first, the order in which a stack pops them."""
+        actions = problem.actions(self.state)
+        if reverse:
+            actions = reversed(list(actions))
+        return (self.child_node(problem, action) for action in actions)
+
     def child_node(self, problem, action):
         """[Figure 3.10]"""
         next_state = problem.result(self.state, action)
@@ -171,11 +185,243 @@ class SimpleProblemSolvingAgentProgram:
         raise NotImplementedError
 
 
+# ______________________________________________________________________________
+
+
+class SearchLimits:
+    """Limits on a search: at most max_nodes nodes examined, at most max_time
+    seconds since the limits were created, and a cancel event (anything with
+    an is_set method, such as a threading.Event) that stops the search once
+    set. Create one per search and pass it as the limits argument; every
+    search checks it for each node it examines.
+
+    A search stopped by its limits returns what it would return on failure
+    (None for the searches that return a node, the current state for the
+    local searches). The limits then say why (reason is 'nodes', 'time' or
+    'cancelled'), how many nodes were examined, the seconds elapsed and the
+    last node examined, the partial result."""
+
+    # The clock and the cancel event are only looked at every so many nodes
+    check_every = 64
+
+    def __init__(self, max_nodes=None, max_time=None, cancel=None):
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.cancel = cancel
+        self.started = time.perf_counter()
+        self.deadline = None if max_time is None else self.started + max_time
+        self.nodes = 0
+        self.node = None
+        self.reason = None
+        self.next_check = 0
+
+    def reached(self, node=None, frontier=0):
+        """Return True if any limit was reached, now or before, otherwise
+        count node as one more node examined. frontier is the size of the
+        frontier of the search at that point."""
+        if self.reason:
+            return True
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            self.reason = 'nodes'
+            return True
+        self.nodes += 1
+        self.node = node
+        if self.nodes >= self.next_check:
+            self.next_check = self.nodes + self.check_every
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                self.reason = 'time'
+            elif self.cancel is not None and self.cancel.is_set():
+                self.reason = 'cancelled'
+        return self.reason is not None
+
+    @property
+    def elapsed(self):
+        """Seconds since the limits were created."""
+        return time.perf_counter() - self.started
+
+    def problem(self, problem):
+        """Return the problem the search should be run on; SearchMetrics
+        returns one that times the calls to the given problem."""
+        return problem
+
+    def timed(self, phase, fn):
+        """Return fn, to be called for the given phase of the search: one
+        of 'actions', 'result' and 'goal_test'; SearchMetrics times it."""
+        return fn
+
+    def __repr__(self):
+        return '<SearchLimits {} nodes in {:.3f}s, stopped by {}>'.format(
+            self.nodes, self.elapsed, self.reason)
+
+
+class SearchMetrics(SearchLimits):
+    """Limits, none by default, that also record statistics of the search:
+    the nodes expanded (calls to actions), generated (calls to result) and
+    goal tested, the largest frontier, the time spent in each of those
+    calls and the peak memory. Pass it as the limits of a search of
+    metrics.problem(problem) instead of problem, then export it with
+    as_dict or to_json. Searches without metrics do none of this work.
+
+    The peak resident set size of the process so far is always recorded,
+    which covers whatever else the process did before the search; with
+    trace_memory, the peak of the memory allocated during this search
+    alone is also traced with tracemalloc, which makes the search much
+    slower."""
+
+    PHASES = ('actions', 'result', 'goal_test')
+
+    def __init__(self, max_nodes=None, max_time=None, cancel=None, trace_memory=False):
+        super().__init__(max_nodes, max_time, cancel)
+        self.max_frontier = 0
+        self.calls = dict.fromkeys(self.PHASES, 0)
+        self.times = dict.fromkeys(self.PHASES, 0.0)
+        self.trace_memory = trace_memory
+        self.traced_peak = None
+        if trace_memory:
+            import tracemalloc
+            # if something else is already tracing, leave it running and
+            # only count what this search allocates on top of it; before
+            # Python 3.9 its peak can't be reset, and then may have been
+            # reached before this search, so it is left unknown
+            self.started_tracing = not tracemalloc.is_tracing()
+            self.peak_known = True
+            if self.started_tracing:
+                tracemalloc.start()
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            else:
+                self.peak_known = False
+            self.traced_base = tracemalloc.get_traced_memory()[0]
+
+    def reached(self, node=None, frontier=0):
+        if frontier > self.max_frontier:
+            self.max_frontier = frontier
+        return super().reached(node, frontier)
+
+    def problem(self, problem):
+        return MeteredProblem(problem, self)
+
+    def timed(self, phase, fn):
+        calls, times, clock = self.calls, self.times, time.perf_counter
+
+        def timed_fn(*args):
+            start = clock()
+            try:
+                return fn(*args)
+            finally:
+                times[phase] += clock() - start
+                calls[phase] += 1
+
+        return timed_fn
+
+    def stop(self):
+        """Stop tracing memory, if it was, keeping the peak of this search."""
+        if self.trace_memory:
+            import tracemalloc
+            if self.peak_known:
+                self.traced_peak = tracemalloc.get_traced_memory()[1] - self.traced_base
+            if self.started_tracing:
+                tracemalloc.stop()
+            self.trace_memory = False
+
+    def as_dict(self):
+        """Return the statistics as a dict of plain values."""
+        self.stop()
+        try:
+            import resource
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:  # not available on Windows
+            peak_rss = None
+        return {
+            'nodes_expanded': self.calls['actions'],
+            'nodes_generated': self.calls['result'],
+            'goal_tests': self.calls['goal_test'],
+            'nodes_examined': self.nodes,
+            'max_frontier': self.max_frontier,
+            'seconds': self.elapsed,
+            'phase_seconds': dict(self.times),
+            'process_peak_rss_kb': peak_rss,
+            'traced_peak_bytes': self.traced_peak,
+            'stopped_by': self.reason,
+        }
+
+    def to_json(self, **kwargs):
+        """Return the statistics as a JSON object."""
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+class MeteredProblem(Problem):
+    """Delegates to a problem, timing its actions, result and goal_test for
+    the given SearchMetrics. Unlike InstrumentedProblem, those methods are
+    bound once, so each call costs a single extra function call."""
+
+    def __init__(self, problem, metrics):
+        super().__init__(problem.initial, problem.goal)
+        self.problem = problem
+        self.actions = metrics.timed('actions', problem.actions)
+        self.result = metrics.timed('result', problem.result)
+        self.goal_test = metrics.timed('goal_test', problem.goal_test)
+        self.path_cost = problem.path_cost
+        self.value = problem.value
+
+    def __getattr__(self, attr):
+        return getattr(self.problem, attr)
+
+
+# ______________________________________________________________________________
+# Frontiers: a stack or a FIFO queue of nodes that also counts the nodes it
+# holds, so that `node in frontier` is a dict lookup instead of a scan.
+
+
+class StackFrontier:
+    """A stack of nodes with constant time membership tests. Nodes are equal
+    if their states are, as for Node.__eq__."""
+
+    def __init__(self, nodes=()):
+        self.nodes = deque()
+        self.counts = {}
+        self.extend(nodes)
+
+    def append(self, node):
+        self.nodes.append(node)
+        self.counts[node] = self.counts.get(node, 0) + 1
+
+    def extend(self, nodes):
+        """Append the nodes one at a time, so that a generator given as nodes
+        already sees the ones appended before."""
+        for node in nodes:
+            self.append(node)
+
+    def pop(self):
+        return self._forget(self.nodes.pop())
+
+    def _forget(self, node):
+        count = self.counts[node] - 1
+        if count:
+            self.counts[node] = count
+        else:
+            del self.counts[node]
+        return node
+
+    def __contains__(self, node):
+        return node in self.counts
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+class FIFOFrontier(StackFrontier):
+    """A FIFO queue of nodes with constant time membership tests."""
+
+    def pop(self):
+        return self._forget(self.nodes.popleft())
+
+
 # ______________________________________________________________________________
 # Uninformed Search algorithms
 
 
-def breadth_first_tree_search(problem):
+def breadth_first_tree_search(problem, limits=None):
     """
     [Figure 3.7]
     Search the shallowest nodes in the search tree first.
@@ -188,13 +434,15 @@ def breadth_first_tree_search(problem):
 
     while frontier:
         node = frontier.popleft()
+        if limits and limits.reached(node, len(frontier)):
+            return None
         if problem.goal_test(node.state):
             return node
         frontier.extend(node.expand(problem))
     return None
 
 
-def depth_first_tree_search(problem):
+def depth_first_tree_search(problem, limits=None):
     """
     [Figure 3.7]
     Search the deepest nodes in the search tree first.
@@ -207,13 +455,66 @@ def depth_first_tree_search(problem):
 
     while frontier:
         node = frontier.pop()
+        if limits and limits.reached(node, len(frontier)):
+            return None
         if problem.goal_test(node.state):
             return node
         frontier.extend(node.expand(problem))
     return None
 
 
-def depth_first_graph_search(problem):
+def lazy_breadth_first_tree_search(problem, limits=None):
+    """Same search as breadth_first_tree_search, but the frontier holds
+    generators of children, so a child is only built when it is popped
+    and the siblings left behind by a goal are never built at all."""
+
+    root = Node(problem.initial)
+    if limits and limits.reached(root):
+        return None
+    if problem.goal_test(root.state):
+        return root
+    frontier = deque([root.expand_lazily(problem)])  # FIFO queue of generators
+
+    while frontier:
+        node = next(frontier[0], None)
+        if node is None:
+            frontier.popleft()
+            continue
+        if limits and limits.reached(node, len(frontier)):
+            return None
+        if problem.goal_test(node.state):
+            return node
+        frontier.append(node.expand_lazily(problem))
+    return None
+
+
+def lazy_depth_first_tree_search(problem, limits=None):
+    """Same search, in the same order, as depth_first_tree_search, but the
+    frontier is a stack of generators of children, so a child is only
+    built when it is popped and the siblings left behind by a goal are
+    never built at all."""
+
+    root = Node(problem.initial)
+    if limits and limits.reached(root):
+        return None
+    if problem.goal_test(root.state):
+        return root
+    frontier = [root.expand_lazily(problem, reverse=True)]  # Stack of generators
+
+    while frontier:
+        node = next(frontier[-1], None)
+        if node is None:
+            frontier.pop()
+            continue
+        if limits and limits.reached(node, len(frontier)):
+            return None
+        if problem.goal_test(node.state):
+            return node
+        frontier.append(node.expand_lazily(problem, reverse=True))
+    return None
+
+
+def depth_first_graph_search(problem, explored=None, limits=None):
     """
     [Figure 3.7]
     Search the deepest nodes in the search tree first.
@@ -221,12 +522,17 @@ def depth_first_graph_search(problem):
     The argument frontier should be an empty queue.
     Does not get trapped by loops.
     If two paths reach a state, only use the first one.
+    The states explored are kept in a set, unless another container, such
+    as a bounded utils.TranspositionTable, is given as explored.
     """
-    frontier = [(Node(problem.initial))]  # Stack
+    frontier = StackFrontier([Node(problem.initial)])
 
-    explored = set()
+    if explored is None:
+        explored = set()
     while frontier:
         node = frontier.pop()
+        if limits and limits.reached(node, len(frontier)):
+            return None
         if problem.goal_test(node.state):
             return node
         explored.add(node.state)
@@ -235,19 +541,24 @@ def depth_first_graph_search(problem):
     return None
 
 
-def breadth_first_graph_search(problem):
+def breadth_first_graph_search(problem, explored=None, limits=None):
     """[Figure 3.11]
     Note that this function can be implemented in a
     single line as below:
     return graph_search(problem, FIFOQueue())
+    The states explored are kept in a set, unless another container, such
+    as a bounded utils.TranspositionTable, is given as explored.
     """
     node = Node(problem.initial)
     if problem.goal_test(node.state):
         return node
-    frontier = deque([node])
-    explored = set()
+    frontier = FIFOFrontier([node])
+    if explored is None:
+        explored = set()
     while frontier:
-        node = frontier.popleft()
+        node = frontier.pop()
+        if limits and limits.reached(node, len(frontier)):
+            return None
         explored.add(node.state)
         for child in node.expand(problem):
             if child.state not in explored and child not in frontier:
@@ -257,7 +568,7 @@ def breadth_first_graph_search(problem):
     return None
 
 
-def best_first_graph_search(problem, f, display=False):
+def best_first_graph_search(problem, f, display=False, limits=None):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
     if f is a heuristic estimate to the goal, then we have greedy best
@@ -272,6 +583,8 @@ def best_first_graph_search(problem, f, display=False):
     explored = set()
     while frontier:
         node = frontier.pop()
+        if limits and limits.reached(node, len(frontier)):
+            return None
         if problem.goal_test(node.state):
             if display:
                 print(len(explored), "paths have been expanded and", len(frontier), "paths remain in the frontier")
@@ -281,43 +594,49 @@ def best_first_graph_search(problem, f, display=False):
             if child.state not in explored and child not in frontier:
                 frontier.append(child)
             elif child in frontier:
-                if f(child) < frontier[child]:
-                    del frontier[child]
-                    frontier.append(child)
+                frontier.decrease_key(child)
     return None
 
 
-def uniform_cost_search(problem, display=False):
+def uniform_cost_search(problem, display=False, limits=None):
     """[Figure 3.14]"""
-    return best_first_graph_search(problem, lambda node: node.path_cost, display)
-
+    return best_first_graph_search(problem, lambda node: node.path_cost, display, limits)
 
-def depth_limited_search(problem, limit=50):
-    """[Figure 3.17]"""
 
-    def recursive_dls(node, problem, limit):
+def depth_limited_search(problem, limit=50, limits=None):
+    """[Figure 3.17]
+    Uses a stack of lazily expanded children instead of recursion, visiting
+    the nodes in the same order. Returns the goal node, None if there is
+    none or the limits were reached, or 'cutoff' if some node at the depth
+    limit still had actions."""
+    node = Node(problem.initial)
+    frontier = []  # Stack of generators of the children of each open node
+    cutoff_occurred = False
+    while True:
+        if limits and limits.reached(node, len(frontier)):
+            return None
         if problem.goal_test(node.state):
             return node
-        elif limit == 0:
-            return 'cutoff'
-        else:
-            cutoff_occurred = False
-            for child in node.expand(problem):
-                result = recursive_dls(child, problem, limit - 1)
-                if result == 'cutoff':
-                    cutoff_occurred = True
-                elif result is not None:
-                    return result
+        if node.depth < limit:
+            frontier.append(node.expand_lazily(problem))
+        elif not cutoff_occurred and problem.actions(node.state):
+            cutoff_occurred = True
+        node = None
+        while frontier and node is None:
+            node = next(frontier[-1], None)
+            if node is None:
+                frontier.pop()
+        if node is None:
             return 'cutoff' if cutoff_occurred else None
 
-    # Body of depth_limited_search:
-    return recursive_dls(Node(problem.initial), problem, limit)
-
 
-def iterative_deepening_search(problem):
-    """[Figure 3.18]"""
+def iterative_deepening_search(problem, limits=None):
+    """[Figure 3.18]
+    Stops as soon as a depth prunes no node that had actions left, since
+    deeper limits would not reach any new node. The limits apply to all
+    the depths together."""
     for depth in range(sys.maxsize):
-        result = depth_limited_search(problem, depth)
+        result = depth_limited_search(problem, depth, limits)
         if result != 'cutoff':
             return result
 
@@ -326,7 +645,7 @@ def iterative_deepening_search(problem):
 # Bidirectional Search
 # Pseudocode from https://webdocs.cs.ualberta.ca/%7Eholte/Publications/MM-AAAI2016.pdf
 
-def bidirectional_search(problem):
+def bidirectional_search(problem, limits=None):
     e = 0
     if isinstance(problem, GraphProblem):
         e = problem.find_min_edge()
@@ -385,6 +704,8 @@ def bidirectional_search(problem):
         return node
 
     while openF and openB:
+        if limits and limits.reached(frontier=len(openF) + len(openB)):
+            return np.inf
         pr_min_f, f_min_f, g_min_f = find_min(openF, gF)
         pr_min_b, f_min_b, g_min_b = find_min(openB, gB)
         C = min(pr_min_f, pr_min_b)
@@ -410,17 +731,17 @@ greedy_best_first_graph_search = best_first_graph_search
 
 
 # Greedy best-first search is accomplished by specifying f(n) = h(n).
-def greedy_search(problem, h=None):
+def greedy_search(problem, h=None, limits=None):
     """f(n) = h(n)"""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, h)
+    return best_first_graph_search(problem, h, limits=limits)
 
-def astar_search(problem, h=None, display=False):
+def astar_search(problem, h=None, display=False, limits=None):
     """A* search is best-first graph search with f(n) = g(n)+h(n).
     You need to specify the h function when you call astar_search, or
     else in your Problem subclass."""
     h = memoize(h or problem.h, 'h')
-    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display)
+    return best_first_graph_search(problem, lambda n: n.path_cost + h(n), display, limits)
 
 
 # ______________________________________________________________________________
@@ -603,11 +924,18 @@ class PlanRoute(Problem):
 # Other search algorithms
 
 
-def recursive_best_first_search(problem, h=None):
-    """[Figure 3.26]"""
+def recursive_best_first_search(problem, h=None, limits=None, key=None):
+    """[Figure 3.26]
+    Successors are tried by lowest f value; key(node), if given, orders
+    them instead, and must still put the lowest f first, for instance to
+    break the ties between equal f values."""
+    key = key or (lambda node: node.f)
     h = memoize(h or problem.h, 'h')
 
-    def RBFS(problem, node, flimit):
+    def RBFS(problem, node, flimit, frontier=0):
+        # frontier counts the successors held on the path down to node
+        if limits and limits.reached(node, frontier):
+            return None, np.inf
         if problem.goal_test(node.state):
             return node, 0  # (The second value is immaterial)
         successors = node.expand(problem)
@@ -617,16 +945,16 @@ def recursive_best_first_search(problem, h=None):
             s.f = max(s.path_cost + h(s), node.f)
         while True:
             # Order by lowest f value
-            successors.sort(key=lambda x: x.f)
+            successors.sort(key=key)
             best = successors[0]
-            if best.f > flimit:
+            if best.f > flimit or best.f == np.inf:  # every successor failed
                 return None, best.f
             if len(successors) > 1:
                 alternative = successors[1].f
             else:
                 alternative = np.inf
-            result, best.f = RBFS(problem, best, min(flimit, alternative))
-            if result is not None:
+            result, best.f = RBFS(problem, best, min(flimit, alternative), frontier + len(successors))
+            if result is not None or (limits and limits.reason):
                 return result, best.f
 
     node = Node(problem.initial)
@@ -635,7 +963,7 @@ def recursive_best_first_search(problem, h=None):
     return result
 
 
-def hill_climbing(problem):
+def hill_climbing(problem, limits=None):
     """
     [Figure 4.2]
     From the initial node, keep choosing the neighbor with highest value,
@@ -643,6 +971,8 @@ def hill_climbing(problem):
     """
     current = Node(problem.initial)
     while True:
+        if limits and limits.reached(current):
+            break
         neighbors = current.expand(problem)
         if not neighbors:
             break
@@ -658,13 +988,13 @@ def exp_schedule(k=20, lam=0.005, limit=100):
     return lambda t: (k * np.exp(-lam * t) if t < limit else 0)
 
 
-def simulated_annealing(problem, schedule=exp_schedule()):
+def simulated_annealing(problem, schedule=exp_schedule(), limits=None):
     """[Figure 4.5] CAUTION: This differs from the pseudocode as it
     returns a state instead of a Node."""
     current = Node(problem.initial)
     for t in range(sys.maxsize):
         T = schedule(t)
-        if T == 0:
+        if T == 0 or (limits and limits.reached(current)):
             return current.state
         neighbors = current.expand(problem)
         if not neighbors:
@@ -675,7 +1005,7 @@ def simulated_annealing(problem, schedule=exp_schedule()):
             current = next_choice
 
 
-def simulated_annealing_full(problem, schedule=exp_schedule()):
+def simulated_annealing_full(problem, schedule=exp_schedule(), limits=None):
     """ This version returns all the states encountered in reaching
     the goal state."""
     states = []
@@ -683,7 +1013,7 @@ def simulated_annealing_full(problem, schedule=exp_schedule()):
     for t in range(sys.maxsize):
         states.append(current.state)
         T = schedule(t)
-        if T == 0:
+        if T == 0 or (limits and limits.reached(current)):
             return states
         neighbors = current.expand(problem)
         if not neighbors:
@@ -694,7 +1024,7 @@ def simulated_annealing_full(problem, schedule=exp_schedule()):
             current = next_choice
 
 
-def and_or_graph_search(problem):
+def and_or_graph_search(problem, limits=None):
     """[Figure 4.11]Used when the environment is nondeterministic and completely observable.
     Contains OR nodes where the agent is free to choose any action.
     After every action there is an AND node which contains all possible states
@@ -707,6 +1037,8 @@ def and_or_graph_search(problem):
     # functions used by and_or_search
     def or_search(state, problem, path):
         """returns a plan as a list of actions"""
+        if limits and limits.reached():
+            return None
         if problem.goal_test(state):
             return []
         if state in path:
@@ -911,7 +1243,7 @@ class LRTAStarAgent:
 # Genetic Algorithm
 
 
-def genetic_search(problem, ngen=1000, pmut=0.1, n=20):
+def genetic_search(problem, ngen=1000, pmut=0.1, n=20, limits=None):
     """Call genetic_algorithm on the appropriate parts of a problem.
     This requires the problem to have states that can mate and mutate,
     plus a value method that scores states."""
@@ -922,12 +1254,16 @@ def genetic_search(problem, ngen=1000, pmut=0.1, n=20):
     s = problem.initial_state
     states = [problem.result(s, a) for a in problem.actions(s)]
     random.shuffle(states)
-    return genetic_algorithm(states[:n], problem.value, ngen, pmut)
+    return genetic_algorithm(states[:n], problem.value, ngen, pmut, limits=limits)
 
 
-def genetic_algorithm(population, fitness_fn, gene_pool=[0, 1], f_thres=None, ngen=1000, pmut=0.1):
-    """[Figure 4.8]"""
+def genetic_algorithm(population, fitness_fn, gene_pool=[0, 1], f_thres=None, ngen=1000, pmut=0.1,
+                      limits=None):
+    """[Figure 4.8]
+    The limits count generations rather than nodes."""
     for i in range(ngen):
+        if limits and limits.reached():
+            break
         population = [mutate(recombine(*select(2, population, fitness_fn)), gene_pool, pmut)
                       for i in range(len(population))]
 
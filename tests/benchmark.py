@@ -0,0 +1,265 @@
+# benchmark.py: Times the solver in-process over the tests, by difficulty, and
+# compares runs against a stored baseline to catch regressions.
+#
+# Usage (from the root of the repository, like tester.py):
+#   python3 tests/benchmark.py [-o results.json] [--csv results.csv]
+#   python3 tests/benchmark.py --compare baseline.json [results.json]
+#
+# Each test is solved `--warmup` times untimed and then `--repetitions` times
+# timed; a last run traces the memory it allocates. For every tier (easy,
+# medium, hard, impossible, instance) the median and 95th percentile of the
+# median time of its tests, the nodes expanded and the peak memory are kept.
+# Comparing reports every tier metric that grew by more than `--threshold`, or
+# at all from zero, including the number of tests left unsolved. With
+# `--timeout`, a test whose run takes longer is given up and left unsolved.
+# `--search` takes any engine of batch.py, including sat.
+
+import argparse
+import csv
+import glob
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from batch import ENGINES  # noqa: E402
+from bimaru import Board  # noqa: E402
+from search import SearchLimits, SearchMetrics  # noqa: E402
+
+tests_folder = r"./tests/instances"
+TIERS = ("easy", "medium", "hard", "impossible", "instance")
+METRICS = ("unsolved", "median", "p95", "nodes_expanded", "peak_memory_bytes")
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of the values."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def solve_test(text, engine, limits=None):
+    """Solves the test given as text with one of the ENGINES, returning the
+    solved board, or None if it has no solution or the limits stopped it."""
+
+    board = Board.parse_instance(io.StringIO(text))
+    board.cleanup()
+    return ENGINES[engine](board, limits=limits)
+
+
+def benchmark_test(text, engine, warmup, repetitions, timeout=None):
+    """Solves the test given as text, returning its timings, the nodes its
+    search expanded and the peak memory allocated while solving it.
+
+    With a timeout, each run gives up after that many seconds; the test is
+    then unsolved and is not run again."""
+
+    def limits():
+        return SearchLimits(max_time=timeout) if timeout else None
+
+    times = []
+    for run in range(warmup + repetitions):
+        run_limits = limits()
+        start_time = time.perf_counter()
+        solve_test(text, engine, run_limits)
+        if run >= warmup:
+            times.append(time.perf_counter() - start_time)
+        if run_limits and run_limits.reason:
+            times = times or [time.perf_counter() - start_time]
+            return {
+                "median": statistics.median(times),
+                "p95": percentile(times, 0.95),
+                "nodes_expanded": run_limits.nodes,
+                "peak_memory_bytes": 0,
+                "solved": False,
+            }
+
+    metrics = SearchMetrics(max_time=timeout)
+    tracemalloc.start()
+    solved = solve_test(text, engine, metrics) is not None
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "median": statistics.median(times),
+        "p95": percentile(times, 0.95),
+        "nodes_expanded": metrics.calls["actions"],
+        "peak_memory_bytes": peak_memory,
+        "solved": solved,
+    }
+
+
+def run(search, warmup, repetitions, tiers=TIERS, timeout=None):
+    """Benchmarks every test of the given tiers with one of the ENGINES,
+    giving up on a test after timeout seconds if given, and returns the
+    results of each tier and of each test."""
+
+    results = {
+        "search": search,
+        "warmup": warmup,
+        "repetitions": repetitions,
+        "timeout": timeout,
+        "python": platform.python_version(),
+        "tiers": {},
+        "tests": {},
+    }
+
+    for tier in tiers:
+        files = sorted(glob.glob(os.path.join(tests_folder, tier + "*.txt")))
+        if not files:
+            continue
+
+        for file_path in files:
+            name = os.path.splitext(os.path.basename(file_path))[0]
+            with open(file_path) as stream:
+                text = stream.read()
+            results["tests"][name] = benchmark_test(
+                text, search, warmup, repetitions, timeout
+            )
+
+        tests = [
+            results["tests"][os.path.splitext(os.path.basename(file_path))[0]]
+            for file_path in files
+        ]
+        medians = [test["median"] for test in tests]
+        results["tiers"][tier] = {
+            "tests": len(tests),
+            "unsolved": sum(not test["solved"] for test in tests),
+            "total": sum(medians),
+            "median": statistics.median(medians),
+            "p95": percentile(medians, 0.95),
+            "nodes_expanded": sum(test["nodes_expanded"] for test in tests),
+            "peak_memory_bytes": max(test["peak_memory_bytes"] for test in tests),
+        }
+
+    return results
+
+
+def print_results(results):
+    print(f"search {results['search']}, {results['repetitions']} repetitions")
+    print(
+        f"{'tier':<12}{'tests':>6}{'total s':>10}{'median ms':>11}{'p95 ms':>9}"
+        f"{'expanded':>10}{'peak KiB':>10}"
+    )
+    for tier, result in results["tiers"].items():
+        print(
+            f"{tier:<12}{result['tests']:>6}{result['total']:>10.3f}"
+            f"{result['median'] * 1000:>11.3f}{result['p95'] * 1000:>9.3f}"
+            f"{result['nodes_expanded']:>10}{result['peak_memory_bytes'] / 1024:>10.1f}"
+        )
+
+
+def write_csv(results, csv_path):
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["tier", "tests", "total"] + list(METRICS))
+        for tier, result in results["tiers"].items():
+            writer.writerow(
+                [tier, result["tests"], result["total"]]
+                + [result[metric] for metric in METRICS]
+            )
+
+
+def compare(baseline, results, threshold):
+    """Prints how every tier metric changed from the baseline to the results
+    and returns the list of those that grew by more than threshold, or at
+    all from zero, such as a tier with unsolved tests where none were."""
+
+    regressions = []
+
+    for tier, result in results["tiers"].items():
+        if tier not in baseline["tiers"]:
+            continue
+        for metric in METRICS:
+            old = baseline["tiers"][tier][metric]
+            new = result[metric]
+            if old:
+                change = (new - old) / old
+            else:
+                change = math.inf if new > old else 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append((tier, metric, old, new))
+            print(
+                f"{tier:<12}{metric:<20}{old:>14.6g}{new:>14.6g}{change:>+9.1%}{flag}"
+            )
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the solver over the tests, by difficulty."
+    )
+    parser.add_argument(
+        "--search",
+        choices=ENGINES,
+        default="dfs",
+        help="search algorithm of bimaru.py, or sat for the SAT solver "
+        "(default: dfs)",
+    )
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--tiers", nargs="+", choices=TIERS, default=TIERS)
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="give up on a test after this many seconds, counting it as "
+        "unsolved",
+    )
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    parser.add_argument("--csv", help="write the results of each tier as CSV")
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar=("BASELINE", "RESULTS"),
+        help="compare a baseline with stored results, or with a new run",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative growth flagged as a regression (default: 0.1)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes a baseline and at most one result file")
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1]) as stream:
+            results = json.load(stream)
+    else:
+        results = run(
+            args.search, args.warmup, args.repetitions, args.tiers, args.timeout
+        )
+        print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(results, stream, indent=1)
+
+    if args.csv:
+        write_csv(results, args.csv)
+
+    if args.compare:
+        with open(args.compare[0]) as stream:
+            baseline = json.load(stream)
+        print()
+        regressions = compare(baseline, results, args.threshold)
+        print(f"\n{len(regressions)} regressions above {args.threshold:.0%}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,55 +4,22 @@ import subprocess
 import numpy
 import re
 import time
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from validator import validate_output
 
 tests_folder = r"./tests/instances"
 results_folder = r"./out"
 bimaru_script = r"./bimaru.py"
 errors_in_tests = []
 
-def group_chars(string):
-    string = string.replace('\n', '')  # Remove newline characters
-    char_list = [string[i * 10 : i * 10 + 10] for i in range(0, 10)]  # Split into 10-character chunks
-    matriz = []
-    for f in char_list:
-        matriz.append([val for val in f])
-    return matriz
-
 def check_result_is_good(test_file_path, thing):
     with open(test_file_path, "r") as k:
-        lines = k.readlines()
-
-    if len(thing.replace("\n", "")) < 100:
-        return False
-
-    matriz = group_chars(thing)
-    # Extract the data from each line
-    row_data = list(map(int, lines[0].split("\t")[1:]))
-    column_data = list(map(int, lines[1].split("\t")[1:]))
-    hints = []
-    for line in lines[3:]:
-        hint_data = line.split("\t")[1:]
-        hints.append((int(hint_data[0]), int(hint_data[1]), hint_data[2].strip()))
-
-    for y in range(10):
-        nr = 0
-        for r_value in matriz[y]:
-            if r_value not in (".", "W"):
-                nr += 1
-        if nr != row_data[y]:
-            return False
-
-        nc = 0
-        for z in range(10):
-            if matriz[z][y] not in (".", "W"):
-                nc += 1
-        if nc != column_data[y]:
-            return False
+        test = k.read()
 
-        for hint in hints:
-            if hint[2] != matriz[hint[0]][hint[1]]:
-                return False
-        return True
+    return not validate_output(test, thing)
 
 # Create the results folder if it doesn't exist
 if not os.path.exists(results_folder):
@@ -143,6 +143,12 @@ def histogram(values, mode=0, bin_function=None):
         return sorted(bins.items())
 
 
+def popcount(mask):
+    """Return the number of bits set in the non-negative integer mask, like
+    int.bit_count, which needs Python 3.10."""
+    return bin(mask).count("1")
+
+
 def dot_product(x, y):
     """Return the sum of the element-wise product of vectors x and y."""
     return sum(_x * _y for _x, _y in zip(x, y))
@@ -724,10 +730,15 @@ class PriorityQueue:
     order) is returned first.
     If order is 'min', the item with minimum f(x) is
     returned first; if order is 'max', then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
+    Also supports dict-like lookup.
+    Items must be hashable: an index from each item to its entries in the
+    heap makes lookup and deletion constant time. Deleted entries are only
+    marked as such and skipped when they reach the top of the heap."""
 
     def __init__(self, order='min', f=lambda x: x):
         self.heap = []
+        self.entries = {}  # item -> its [value, item, alive] entries in the heap
+        self.size = 0
         if order == 'min':
             self.f = f
         elif order == 'max':  # now item with max f(x)
@@ -737,7 +748,10 @@ class PriorityQueue:
 
     def append(self, item):
         """Insert item at its correct position."""
-        heapq.heappush(self.heap, (self.f(item), item))
+        entry = [self.f(item), item, True]
+        heapq.heappush(self.heap, entry)
+        self.entries.setdefault(item, []).append(entry)
+        self.size += 1
 
     def extend(self, items):
         """Insert each item in items at its correct position."""
@@ -747,34 +761,135 @@ class PriorityQueue:
     def pop(self):
         """Pop and return the item (with min or max f(x) value)
         depending on the order."""
-        if self.heap:
-            return heapq.heappop(self.heap)[1]
-        else:
-            raise Exception('Trying to pop from empty PriorityQueue.')
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if entry[2]:
+                self._forget(entry)
+                return entry[1]
+        raise Exception('Trying to pop from empty PriorityQueue.')
+
+    def decrease_key(self, item):
+        """Move the first occurrence of item to the position of its current
+        f(item), if that comes before its old one. Returns True if it moved."""
+        value = self.f(item)
+        if value < self[item]:
+            del self[item]
+            self.append(item)
+            return True
+        return False
+
+    def _forget(self, entry):
+        """Remove the entry, no longer alive in the heap, from the index."""
+        entry[2] = False
+        entries = self.entries[entry[1]]
+        for i, other in enumerate(entries):
+            if other is entry:
+                del entries[i]
+                break
+        if not entries:
+            del self.entries[entry[1]]
+        self.size -= 1
 
     def __len__(self):
         """Return current capacity of PriorityQueue."""
-        return len(self.heap)
+        return self.size
 
     def __contains__(self, key):
         """Return True if the key is in PriorityQueue."""
-        return any([item == key for _, item in self.heap])
+        return key in self.entries
 
     def __getitem__(self, key):
         """Returns the first value associated with key in PriorityQueue.
         Raises KeyError if key is not present."""
-        for value, item in self.heap:
-            if item == key:
-                return value
-        raise KeyError(str(key) + " is not in the priority queue")
+        if key not in self.entries:
+            raise KeyError(str(key) + " is not in the priority queue")
+        return self.entries[key][0][0]
 
     def __delitem__(self, key):
         """Delete the first occurrence of key."""
-        try:
-            del self.heap[[item == key for _, item in self.heap].index(True)]
-        except ValueError:
+        if key not in self.entries:
             raise KeyError(str(key) + " is not in the priority queue")
-        heapq.heapify(self.heap)
+        self._forget(self.entries[key][0])
+        if len(self.heap) > 2 * self.size + 64:  # mostly deleted entries
+            self.heap = [entry for entry in self.heap if entry[2]]
+            heapq.heapify(self.heap)
+
+
+class TranspositionTable:
+    """A set of the states already seen by a search, holding at most maxsize
+    of them. Once it is full, adding a state forgets the least recently
+    seen one, so that it can replace an unbounded explored set without
+    growing with the whole search space."""
+
+    def __init__(self, maxsize=2 ** 16):
+        self.maxsize = maxsize
+        self.states = collections.OrderedDict()
+
+    def add(self, state):
+        """Remember state, forgetting the least recently seen one if full."""
+        self.states[state] = None
+        self.states.move_to_end(state)
+        if len(self.states) > self.maxsize:
+            self.states.popitem(last=False)
+
+    def __contains__(self, state):
+        """Return True if state was seen, marking it as recently seen."""
+        if state in self.states:
+            self.states.move_to_end(state)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.states)
+
+    def clear(self):
+        self.states.clear()
+
+
+class NogoodStore:
+    """A set of nogoods, sets of decisions that can't all be part of a
+    solution, holding at most maxsize of them. Like TranspositionTable,
+    once it is full, adding a nogood forgets the least recently used one.
+    Nogoods are found through the decisions they hold, so that a search
+    only looks at the ones holding the decision it just made."""
+
+    def __init__(self, maxsize=2 ** 12):
+        self.maxsize = maxsize
+        self.nogoods = collections.OrderedDict()
+        self.index = collections.defaultdict(set)  # decision -> its nogoods
+
+    def add(self, nogood):
+        """Remember nogood, forgetting the least recently used one if full."""
+        nogood = frozenset(nogood)
+        if nogood in self.nogoods:
+            self.nogoods.move_to_end(nogood)
+            return
+        self.nogoods[nogood] = None
+        for decision in nogood:
+            self.index[decision].add(nogood)
+        if len(self.nogoods) > self.maxsize:
+            forgotten, _ = self.nogoods.popitem(last=False)
+            for decision in forgotten:
+                self.index[decision].discard(forgotten)
+                if not self.index[decision]:
+                    del self.index[decision]
+
+    def find(self, decisions, latest):
+        """Return a nogood holding latest and otherwise only members of the
+        set decisions, marking it as recently used, or None if there is
+        none."""
+        for nogood in self.index.get(latest, ()):
+            if nogood <= decisions:
+                self.nogoods.move_to_end(nogood)
+                return nogood
+        return None
+
+    def __len__(self):
+        return len(self.nogoods)
+
+    def clear(self):
+        self.nogoods.clear()
+        self.index.clear()
 
 
 # ______________________________________________________________________________
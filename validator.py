@@ -0,0 +1,134 @@
+# validator.py: Checks that a board is a solution of a Bimaru test.
+#
+# Every rule is checked over whole bitmasks of the board at once, shifting
+# them to compare each cell with its neighbours, so validating a solution
+# costs a few dozen integer operations and can be done for every solution.
+
+import io
+from typing import List, Optional, Sequence
+
+from bimaru import Board
+from utils import popcount
+
+
+def validate(
+    solution: Board, puzzle: Board, fleet: Optional[Sequence[int]] = None
+) -> List[str]:
+    """Returns the rules of the puzzle, as returned by parse_instance, that
+    the solution breaks, or an empty list if it solves the puzzle.
+
+    fleet[size - 1] is the number of boats of each size, the fleet of the
+    puzzle by default."""
+
+    if fleet is None:
+        fleet = puzzle.fleet
+
+    layout = solution.layout
+    stride = layout.stride
+    errors = []
+
+    boats = solution.get_boat_cells()
+
+    if solution.placeholders or (boats | solution.water) != layout.cells:
+        errors.append("not every cell holds water or a boat segment")
+    if boats & solution.water:
+        errors.append("some cells hold water and a boat segment")
+
+    # The hint cells and the boat cells of each row and column
+    if puzzle.water & ~solution.water:
+        errors.append("some water hints are not water")
+    for index, segment in enumerate(puzzle.segments):
+        if segment & ~solution.segments[index]:
+            errors.append(f"some {Board.SEGMENTS[index].upper()} hints do not match")
+    if puzzle.placeholders & ~boats:
+        errors.append("some boat hints are water")
+    if solution.fixed != puzzle.fixed:
+        errors.append("the hint cells, and only them, should be in upper case")
+
+    # The puzzle's hints were already discounted of its own boat cells
+    for row, mask in enumerate(layout.row_masks):
+        hint = puzzle.row_hints[row] + puzzle.get_boats_row(row)
+        if popcount(boats & mask) != hint:
+            errors.append(f"row {row} does not have as many boat cells as its hint")
+    for col, mask in enumerate(layout.column_masks):
+        hint = puzzle.column_hints[col] + puzzle.get_boats_col(col)
+        if popcount(boats & mask) != hint:
+            errors.append(f"column {col} does not have as many boat cells as its hint")
+
+    # The neighbours of each boat cell
+    has_left = boats & (boats << 1)
+    has_right = boats & (boats >> 1)
+    has_above = boats & (boats << stride)
+    has_below = boats & (boats >> stride)
+    horizontal = has_left | has_right
+    vertical = has_above | has_below
+
+    if boats & layout.spread(boats, "diagonals"):
+        errors.append("some boats touch diagonally")
+    if horizontal & vertical:
+        errors.append("some boats are not straight lines")
+
+    # The segment each boat cell should hold, given its neighbours
+    singles = boats & ~horizontal & ~vertical
+    expected = (
+        singles,
+        has_below & ~has_above,
+        has_above & ~has_below,
+        has_right & ~has_left,
+        has_left & ~has_right,
+        (has_left & has_right) | (has_above & has_below),
+    )
+    for index, (segment, cells) in enumerate(zip(solution.segments, expected)):
+        if segment != cells:
+            errors.append(f"some {Board.SEGMENTS[index]} segments are misplaced")
+
+    # The fleet: count the runs of at least each size along rows and columns
+    counts = []
+    starts = (
+        boats & ~(boats << 1) & ~vertical,
+        boats & ~(boats << stride) & ~horizontal,
+    )
+    runs = [boats, boats]
+    for size in range(1, len(fleet) + 2):
+        if size > 1:
+            runs = [
+                runs[0] & (boats >> (size - 1)),
+                runs[1] & (boats >> (size - 1) * stride),
+            ]
+        at_least = popcount(starts[0] & runs[0]) + popcount(starts[1] & runs[1])
+        if size == 1:
+            at_least -= popcount(singles)  # single cells start a run both ways
+        counts.append(at_least)
+
+    found = [counts[size] - counts[size + 1] for size in range(len(fleet))]
+    if counts[len(fleet)] or found != list(fleet):
+        errors.append(
+            f"the fleet has {found} boats of each size instead of {list(fleet)}"
+        )
+
+    return errors
+
+
+def validate_output(
+    test: str, output: str, fleet: Optional[Sequence[int]] = None
+) -> List[str]:
+    """Validates the output printed for a test, both given as text. A fleet
+    given in the test takes the place of fleet, Board.FLEET by default."""
+
+    puzzle = Board.parse_instance(io.StringIO(test), fleet)
+    lines = output.split()
+    layout = puzzle.layout
+
+    if len(lines) != layout.rows or any(len(line) != layout.columns for line in lines):
+        return [f"the output is not {layout.rows} lines of {layout.columns} cells"]
+
+    solution = Board(puzzle.row_hints, puzzle.column_hints, puzzle.boats, puzzle.fleet)
+    for row, line in enumerate(lines):
+        for col, symbol in enumerate(line):
+            if symbol == ".":
+                symbol = "w"
+            if symbol.lower() not in "w" + Board.SEGMENTS:
+                return [f"unknown symbol {symbol!r} in row {row}"]
+            solution.place_symbol(symbol, row, col)
+
+    return validate(solution, puzzle)